@@ -7,8 +7,11 @@ from typing import Dict, List, Optional
 
 from infrahub_sdk.batch import InfrahubBatch
 from infrahub_sdk import InfrahubClient
+from infrahub_sdk.exceptions import NodeNotFoundError
+from infrahub_sdk.node import InfrahubNode
 
 from utils import (
+    PoolAllocationScheduler,
     create_and_save,
     create_and_add_to_batch,
     create_ipam_pool,
@@ -547,6 +550,24 @@ async def create_location_public_and_supernet(
     organisation,
 ):
     batch = await client.create_batch()
+
+    def create_pool_on_allocation(role: str, location: str, default_prefix_length: int):
+        async def create_pool(prefix: InfrahubNode) -> None:
+            await create_ipam_pool(
+                client=client,
+                log=log,
+                branch=branch,
+                prefix=str(prefix.prefix.value),
+                role=role,
+                location=location,
+                default_prefix_length=default_prefix_length,
+                batch=batch,
+                prefix_obj=prefix,
+            )
+
+        return create_pool
+
+    scheduler = PoolAllocationScheduler(client=client, log=log, branch=branch)
     for location in site_locations:
         location_name = location["name"]
         location_shortname = location["shortname"]
@@ -561,24 +582,15 @@ async def create_location_public_and_supernet(
             "status": {"value": "active"},
             "role": {"value": "supernet"},
         }
-        location_supernet = await client.allocate_next_ip_prefix(
+        scheduler.add(
             resource_pool=supernet_container_pool,
-            kind="InfraPrefix",
-            branch=branch,
-            data=data_prefix,
             identifier=supernet_description,
+            data=data_prefix,
+            on_allocated=create_pool_on_allocation(
+                role="supernet", location=location_shortname, default_prefix_length=24
+            ),
         )
-        await location_supernet.save()
-        await create_ipam_pool(
-            client=client,
-            log=log,
-            branch=branch,
-            prefix=str(location_supernet.prefix.value),
-            role="supernet",
-            location=location_shortname,
-            default_prefix_length=24,
-            batch=batch,
-        )
+
         public_description = f"{location_shortname.lower()}-public"
         # Get next public (/28) from container pool
         data_prefix = {
@@ -588,24 +600,17 @@ async def create_location_public_and_supernet(
             "status": {"value": "active"},
             "role": {"value": "public"},
         }
-        location_public = await client.allocate_next_ip_prefix(
+        scheduler.add(
             resource_pool=public_container_pool,
-            kind="InfraPrefix",
-            branch=branch,
-            data=data_prefix,
             identifier=public_description,
+            data=data_prefix,
+            on_allocated=create_pool_on_allocation(
+                role="public", location=location_shortname, default_prefix_length=32
+            ),
         )
-        await location_public.save()
-        await create_ipam_pool(
-            client=client,
-            log=log,
-            branch=branch,
-            prefix=str(location_public.prefix.value),
-            role="public",
-            location=location_shortname,
-            default_prefix_length=32,
-            batch=batch,
-        )
+
+    # Allocations from the supernet and public containers run side by side
+    await scheduler.execute()
 
     # Execute Supernet Pool batch
     await execute_batch(batch=batch, log=log)
@@ -743,16 +748,28 @@ async def create_location(client: InfrahubClient, log: logging.Logger, branch: s
     #   - XX.XX.01.0/24 -> Technical
     #   - XX.XX.02.0/24 -> Loopback
     #   - XX.XX.03.0/24 -> Loopback VTEP
-    batch = await client.create_batch()
+    location_supernet_pools = await client.filters(
+        kind="CoreIPPrefixPool",
+        branch=branch,
+        name__values=[
+            f"supernet-{location['shortname'].lower()}" for location in site_locations
+        ],
+    )
+    pools_by_name = {pool.name.value: pool for pool in location_supernet_pools}
+
+    scheduler = PoolAllocationScheduler(client=client, log=log, branch=branch)
     for location in site_locations:
         location_name = location["name"]
         location_shortname = location["shortname"]
         location_obj = client.store.get(key=location_name, kind="LocationBuilding")
-        location_supernet_pool = await client.get(
-            kind="CoreIPPrefixPool",
-            name__value=f"supernet-{location_shortname.lower()}",
-            raise_when_missing=True,
+        location_supernet_pool = pools_by_name.get(
+            f"supernet-{location_shortname.lower()}"
         )
+        if not location_supernet_pool:
+            raise NodeNotFoundError(
+                node_type="CoreIPPrefixPool",
+                identifier={"name__value": [f"supernet-{location_shortname.lower()}"]},
+            )
         for role in ("management", "technical", "loopback", "loopback-vtep"):
             prefix_description = f"{location_shortname.lower()}-{role}"
             data_prefix = {
@@ -776,16 +793,15 @@ async def create_location(client: InfrahubClient, log: logging.Logger, branch: s
                 if role != "technical":
                     member_type = "address"
 
-            prefix = await client.allocate_next_ip_prefix(
+            # Roles of a location share its supernet pool, so they stay in order
+            scheduler.add(
                 resource_pool=location_supernet_pool,
-                kind="InfraPrefix",
-                branch=branch,
-                data=data_prefix,
                 identifier=prefix_description,
+                data=data_prefix,
                 member_type=member_type,
             )
-            batch.add(task=prefix.save, node=prefix)
-    await execute_batch(batch=batch, log=log)
+    allocated = await scheduler.execute()
+    log.info(f"- Allocated {len(allocated)} location prefixes")
 
 
 # ---------------------------------------------------------------
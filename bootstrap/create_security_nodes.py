@@ -1,16 +1,19 @@
 #!/usr/bin/env python
 import ipaddress
 import logging
+import time
 
 from dataclasses import dataclass
 from enum import auto, Enum
-from typing import Any, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 
 from infrahub_sdk import InfrahubClient
 from infrahub_sdk.node import InfrahubNode
 from infrahub_sdk.exceptions import NodeNotFoundError
 
+from utils import create_and_add_to_batch
+
 
 @dataclass
 class IPProtocol:
@@ -317,142 +320,193 @@ RULES = [
 ]
 
 
-async def run(client: InfrahubClient, log: logging.Logger, branch: str) -> None:
-    for ip_proto in IP_PROTOCOLS:
-        obj = await client.create(
-            kind="SecurityIPProtocol",
-            name=ip_proto.name,
-            protocol=ip_proto.protocol,
-            description=ip_proto.description,
-        )
-        await obj.save(allow_upsert=True)
-        client.store.set(key=obj.name.value, node=obj)
-
-    for service in SERVICES:
-        proto = client.store.get(key=service.ip_protocol.name)
-        obj = await client.create(
-            kind="SecurityService",
-            name=service.name,
-            description=service.description,
-            ip_protocol=proto,
-            port=service.port,
-        )
-        await obj.save(allow_upsert=True)
-        client.store.set(key=obj.name.value, node=obj)
+def rule_object_name(rule: SecurityPolicyRule) -> str:
+    # Rule names aren't unique, a rule is identified by its position in its policy
+    return f"{rule.policy.name}-{rule.index}-{rule.name}"
 
-    for service_group in SERVICE_GROUPS:
-        services = [
-            client.store.get(service.name) for service in service_group.services
-        ]
-        obj = await client.create(
-            kind="SecurityServiceGroup", name=service_group.name, services=services
-        )
-        await obj.save(allow_upsert=True)
-        client.store.set(key=obj.name.value, node=obj)
 
-    for prefix in PREFIXES:
-        obj = await client.create(
-            "SecurityPrefix", name=prefix.name, prefix=prefix.prefix
-        )
-        await obj.save(allow_upsert=True)
-        client.store.set(key=obj.name.value, node=obj)
+def store_get_or_none(client: InfrahubClient, key: str) -> Optional[InfrahubNode]:
+    try:
+        return client.store.get(key=key)
+    except NodeNotFoundError:
+        return None
+
 
-    for address in ADDRESSES:
-        obj = await client.create(
-            "SecurityIPAddress", name=address.name, address=address.address
+def rule_data(client: InfrahubClient, rule: SecurityPolicyRule) -> Dict[str, Any]:
+    def store_get_many(objects: Optional[List[Any]]) -> Optional[List[InfrahubNode]]:
+        if not objects:
+            return None
+        return [store_get_or_none(client, obj.name) for obj in objects]
+
+    return {
+        "name": rule.name,
+        "policy": store_get_or_none(client, rule.policy.name),
+        "index": rule.index,
+        "action": rule.action.name,
+        "source_zone": store_get_or_none(client, rule.source_zone.name),
+        "destination_zone": store_get_or_none(client, rule.destination_zone.name),
+        "source_address": store_get_many(rule.source_addresses),
+        "source_groups": store_get_many(rule.source_groups),
+        "source_services": store_get_many(rule.source_services),
+        "source_service_groups": store_get_many(rule.source_service_groups),
+        "destination_address": store_get_many(rule.destination_addresses),
+        "destination_groups": store_get_many(rule.destination_groups),
+        "destination_services": store_get_many(rule.destination_services),
+        "destination_service_groups": store_get_many(rule.destination_service_groups),
+    }
+
+
+async def save_level(
+    client: InfrahubClient,
+    log: logging.Logger,
+    branch: str,
+    level: str,
+    objects: List[Tuple[str, str, Dict[str, Any]]],
+) -> None:
+    """Save the (name, kind, data) objects of one dependency level in a single batch.
+
+    Every object of the level is attempted, then the run stops if any of them
+    failed, as the next levels would reference the missing objects.
+    """
+    started_at = time.perf_counter()
+    batch = await client.create_batch(return_exceptions=True)
+    names: Dict[int, str] = {}
+    for object_name, kind, data in objects:
+        node = await create_and_add_to_batch(
+            client=client,
+            log=log,
+            branch=branch,
+            object_name=object_name,
+            kind_name=kind,
+            data=data,
+            batch=batch,
         )
-        await obj.save(allow_upsert=True)
-        client.store.set(key=obj.name.value, node=obj)
+        names[id(node)] = object_name
+
+    failures = 0
+    async for node, result in batch.execute():
+        if isinstance(result, Exception):
+            failures += 1
+            log.error(
+                f"- Failed to save [{node._schema.kind}] '{names[id(node)]}': {result}"
+            )
+    if failures:
+        raise RuntimeError(f"{failures} of {len(objects)} {level} failed to save")
+    log.info(
+        f"- Saved {len(objects)} {level} in {time.perf_counter() - started_at:.2f}s"
+    )
 
-    for address_group in ADDRESS_GROUPS:
-        addresses = [
-            client.store.get(key=address.name) for address in address_group.addresses
+
+async def run(client: InfrahubClient, log: logging.Logger, branch: str) -> None:
+    # Objects are saved level by level, a level only references objects of the previous ones
+    await save_level(
+        client,
+        log,
+        branch,
+        level="IP protocols, prefixes, addresses, zones and policies",
+        objects=[
+            (
+                ip_proto.name,
+                "SecurityIPProtocol",
+                {
+                    "name": ip_proto.name,
+                    "protocol": ip_proto.protocol,
+                    "description": ip_proto.description,
+                },
+            )
+            for ip_proto in IP_PROTOCOLS
         ]
-        obj = await client.create(
-            kind="SecurityAddressGroup", name=address_group.name, addresses=addresses
-        )
-        await obj.save(allow_upsert=True)
-        client.store.set(key=obj.name.value, node=obj)
-
-    for security_zone in SECURITY_ZONES:
-        obj = await client.create(kind="SecurityZone", name=security_zone.name)
-        await obj.save(allow_upsert=True)
-        client.store.set(key=obj.name.value, node=obj)
-
-    for policy in POLICIES:
-        obj = await client.create(kind="SecurityPolicy", name=policy.name)
-        await obj.save(allow_upsert=True)
-        client.store.set(key=obj.name.value, node=obj)
-
-    def store_get_or_none(key) -> Optional[InfrahubNode]:
-        try:
-            return client.store.get(key=key)
-        except NodeNotFoundError:
-            return None
+        + [
+            (
+                prefix.name,
+                "SecurityPrefix",
+                {"name": prefix.name, "prefix": prefix.prefix},
+            )
+            for prefix in PREFIXES
+        ]
+        + [
+            (
+                address.name,
+                "SecurityIPAddress",
+                {"name": address.name, "address": address.address},
+            )
+            for address in ADDRESSES
+        ]
+        + [
+            (security_zone.name, "SecurityZone", {"name": security_zone.name})
+            for security_zone in SECURITY_ZONES
+        ]
+        + [
+            (policy.name, "SecurityPolicy", {"name": policy.name})
+            for policy in POLICIES
+        ],
+    )
 
-    for rule in RULES:
-        policy = store_get_or_none(rule.policy.name)
-        source_zone = store_get_or_none(rule.source_zone.name)
-        destination_zone = store_get_or_none(rule.destination_zone.name)
-        source_address = (
-            [store_get_or_none(address.name) for address in rule.source_addresses]
-            if rule.source_addresses
-            else None
-        )
-        source_groups = (
-            [store_get_or_none(group.name) for group in rule.source_groups]
-            if rule.source_groups
-            else None
-        )
-        source_services = (
-            [store_get_or_none(service.name) for service in rule.source_services]
-            if rule.source_services
-            else None
-        )
-        source_service_groups = (
-            [store_get_or_none(group.name) for group in rule.source_service_groups]
-            if rule.source_service_groups
-            else None
-        )
-        destination_address = (
-            [store_get_or_none(address.name) for address in rule.destination_addresses]
-            if rule.destination_addresses
-            else None
-        )
-        destination_groups = (
-            [store_get_or_none(group.name) for group in rule.destination_groups]
-            if rule.destination_groups
-            else None
-        )
-        destination_services = (
-            [store_get_or_none(service.name) for service in rule.destination_services]
-            if rule.destination_services
-            else None
-        )
-        destination_service_groups = (
-            [store_get_or_none(group.name) for group in rule.destination_service_groups]
-            if rule.destination_service_groups
-            else None
-        )
-        obj = await client.create(
-            kind="SecurityPolicyRule",
-            name=rule.name,
-            policy=policy,
-            index=rule.index,
-            action=rule.action.name,
-            source_zone=source_zone,
-            destination_zone=destination_zone,
-            source_address=source_address,
-            source_groups=source_groups,
-            source_services=source_services,
-            source_service_groups=source_service_groups,
-            destination_address=destination_address,
-            destination_groups=destination_groups,
-            destination_services=destination_services,
-            destination_service_groups=destination_service_groups,
-        )
+    await save_level(
+        client,
+        log,
+        branch,
+        level="services and address groups",
+        objects=[
+            (
+                service.name,
+                "SecurityService",
+                {
+                    "name": service.name,
+                    "description": service.description,
+                    "ip_protocol": client.store.get(key=service.ip_protocol.name),
+                    "port": service.port,
+                },
+            )
+            for service in SERVICES
+        ]
+        + [
+            (
+                address_group.name,
+                "SecurityAddressGroup",
+                {
+                    "name": address_group.name,
+                    "addresses": [
+                        client.store.get(key=address.name)
+                        for address in address_group.addresses
+                    ],
+                },
+            )
+            for address_group in ADDRESS_GROUPS
+        ],
+    )
+
+    await save_level(
+        client,
+        log,
+        branch,
+        level="service groups",
+        objects=[
+            (
+                service_group.name,
+                "SecurityServiceGroup",
+                {
+                    "name": service_group.name,
+                    "services": [
+                        client.store.get(key=service.name)
+                        for service in service_group.services
+                    ],
+                },
+            )
+            for service_group in SERVICE_GROUPS
+        ],
+    )
 
-        await obj.save(allow_upsert=True)
+    await save_level(
+        client,
+        log,
+        branch,
+        level="policy rules",
+        objects=[
+            (rule_object_name(rule), "SecurityPolicyRule", rule_data(client, rule))
+            for rule in RULES
+        ],
+    )
 
     manufacturer = await client.get("OrganizationManufacturer", name__value="Juniper")
     platform = await client.get("InfraPlatform", name__value="Juniper JunOS")
@@ -506,7 +560,7 @@ async def run(client: InfrahubClient, log: logging.Logger, branch: str) -> None:
     ]
 
     for interface, zone, ip in interfaces:
-        security_zone = store_get_or_none(zone)
+        security_zone = store_get_or_none(client, zone)
 
         firewall_interface = await client.create(
             kind="SecurityFirewallInterface",
@@ -524,5 +578,5 @@ async def run(client: InfrahubClient, log: logging.Logger, branch: str) -> None:
         firewall_interface.ip_addresses.add(ip_address)
         await firewall_interface.save(allow_upsert=True)
 
-    device.policy = store_get_or_none(FRA_FW1_POLICY.name)
+    device.policy = store_get_or_none(client, FRA_FW1_POLICY.name)
     await device.save()
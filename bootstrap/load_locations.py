@@ -0,0 +1,285 @@
+import csv
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+import yaml
+from infrahub_sdk import InfrahubClient
+from infrahub_sdk.node import InfrahubNode
+
+# flake8: noqa
+# pylint: skip-file
+
+# ---------------------------------------------------------------
+# Streaming loader for external location inventories (CSV or YAML).
+#
+# Every record describes one path of the hierarchy, from the continent down to
+# the deepest known level (usually the rack):
+#
+#   continent,country,region,metro,building,floor,suite,rack,building_shortname,...
+#   Europe,Germany,de-central,Frankfurt,Equinix FRA05,floor-32,suite-325,Rack-05,FRA05,...
+#
+# Optional columns per level: <level>_shortname, <level>_timezone,
+# <level>_facility_id (building, suite) and <level>_owner (building, suite, rack).
+# Shortnames are unique, a level without one gets the shortname of its parent
+# followed by its name, like FRA05-FLOOR-32 for a floor of the FRA05 building.
+#
+# YAML inputs are read document by document, each document being a record
+# or a list of records, so large exports should be split in several documents.
+#
+# Records sorted by hierarchy keep the ancestor cache hot, unsorted inputs
+# still load correctly as every location is saved with upsert.
+# ---------------------------------------------------------------
+
+
+@dataclass
+class LocationLevel:
+    name: str
+    kind: str
+    label: str
+    has_facility_id: bool = False
+    has_owner: bool = False
+
+
+LOCATION_LEVELS = [
+    LocationLevel(name="continent", kind="LocationContinent", label="Continent"),
+    LocationLevel(name="country", kind="LocationCountry", label="Country"),
+    LocationLevel(name="region", kind="LocationRegion", label="Region"),
+    LocationLevel(name="metro", kind="LocationMetro", label="Metro area"),
+    LocationLevel(
+        name="building",
+        kind="LocationBuilding",
+        label="Building",
+        has_facility_id=True,
+        has_owner=True,
+    ),
+    LocationLevel(name="floor", kind="LocationFloor", label="Floor"),
+    LocationLevel(
+        name="suite",
+        kind="LocationSuite",
+        label="Suite",
+        has_facility_id=True,
+        has_owner=True,
+    ),
+    # Rack facility IDs are computed from their suite
+    LocationLevel(name="rack", kind="LocationRack", label="Rack", has_owner=True),
+]
+
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_CACHE_SIZE = 10_000
+
+
+def read_records(path: Path) -> Iterator[Dict[str, Any]]:
+    """Yield the records of an inventory file one at a time."""
+    with open(path, newline="") as file:
+        if path.suffix.lower() == ".csv":
+            for row in csv.DictReader(file):
+                yield {key: value for key, value in row.items() if value}
+        elif path.suffix.lower() in (".yml", ".yaml"):
+            for document in yaml.safe_load_all(file):
+                if isinstance(document, list):
+                    yield from document
+                elif document:
+                    yield document
+        else:
+            raise ValueError(f"Unsupported inventory format {path.suffix}")
+
+
+class LocationStreamLoader:
+    """Build the location hierarchy from a stream of records with bounded memory.
+
+    New locations are kept pending until `chunk_size` of them are collected, then
+    saved through one batch per hierarchy level so parents always exist before
+    their children. Saved locations only leave their ID behind in an LRU cache
+    of `cache_size` paths, they are written with `create` rather than `save`
+    which would also keep every node in the client store.
+    """
+
+    def __init__(
+        self,
+        client: InfrahubClient,
+        log: logging.Logger,
+        branch: str,
+        organizations: Dict[str, str],
+        source_id: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ):
+        self.client = client
+        self.log = log
+        self.branch = branch
+        self.organizations = organizations
+        self.source_id = source_id
+        self.chunk_size = chunk_size
+        self.cache_size = cache_size
+
+        self._pending: List[List[InfrahubNode]] = [[] for _ in LOCATION_LEVELS]
+        self._pending_paths: Dict[Tuple[str, ...], InfrahubNode] = {}
+        self._saved: OrderedDict[Tuple[str, ...], str] = OrderedDict()
+
+        self.records = 0
+        self.locations = 0
+        self.chunks = 0
+        self._started_at = time.perf_counter()
+
+    def _lookup(self, path: Tuple[str, ...]) -> Optional[Union[InfrahubNode, str]]:
+        if path in self._pending_paths:
+            return self._pending_paths[path]
+        if path in self._saved:
+            self._saved.move_to_end(path)
+            return self._saved[path]
+        return None
+
+    def _remember(self, path: Tuple[str, ...], node_id: str) -> None:
+        self._saved[path] = node_id
+        if len(self._saved) > self.cache_size:
+            self._saved.popitem(last=False)
+
+    def _build_data(
+        self,
+        level: LocationLevel,
+        record: Dict[str, Any],
+        path: Tuple[str, ...],
+        shortname: str,
+        parent: Optional[Union[InfrahubNode, str]],
+    ) -> Dict[str, Any]:
+        name = path[-1]
+        name_data: Dict[str, Any] = {"value": name, "is_protected": True}
+        if self.source_id:
+            name_data["source"] = self.source_id
+
+        data: Dict[str, Any] = {
+            "name": name_data,
+            "description": {"value": f"{level.label} {name.lower()}"},
+            "shortname": shortname,
+        }
+        if parent:
+            data["parent"] = parent
+        if record.get(f"{level.name}_timezone"):
+            data["timezone"] = record[f"{level.name}_timezone"]
+        if level.has_facility_id and record.get(f"{level.name}_facility_id"):
+            data["facility_id"] = str(record[f"{level.name}_facility_id"]).upper()
+        owner = record.get(f"{level.name}_owner")
+        if level.has_owner and owner in self.organizations:
+            data["owner"] = self.organizations[owner]
+        return data
+
+    async def add_record(self, record: Dict[str, Any]) -> None:
+        self.records += 1
+        parent: Optional[Union[InfrahubNode, str]] = None
+        path: Tuple[str, ...] = ()
+        shortname = ""
+        for depth, level in enumerate(LOCATION_LEVELS):
+            name = record.get(level.name)
+            if not name:
+                break
+            path += (str(name),)
+            shortname = (
+                record.get(f"{level.name}_shortname")
+                or (f"{shortname}-{name}" if shortname else str(name)).upper()
+            )
+
+            location = self._lookup(path)
+            if location is None:
+                location = await self.client.create(
+                    kind=level.kind,
+                    branch=self.branch,
+                    data=self._build_data(
+                        level=level,
+                        record=record,
+                        path=path,
+                        shortname=shortname,
+                        parent=parent,
+                    ),
+                )
+                self._pending[depth].append(location)
+                self._pending_paths[path] = location
+                if len(self._pending_paths) >= self.chunk_size:
+                    await self.flush()
+            parent = location
+
+    async def flush(self) -> None:
+        """Save the pending locations, one batch per level from the top down."""
+        if not self._pending_paths:
+            return
+
+        chunk_started_at = time.perf_counter()
+        for nodes in self._pending:
+            if not nodes:
+                continue
+            batch = await self.client.create_batch()
+            for node in nodes:
+                batch.add(task=node.create, allow_upsert=True, node=node)
+            async for _ in batch.execute():
+                pass
+            nodes.clear()
+
+        count = len(self._pending_paths)
+        for path, node in self._pending_paths.items():
+            self._remember(path, node.id)
+        self._pending_paths.clear()
+
+        self.chunks += 1
+        self.locations += count
+        elapsed = time.perf_counter() - chunk_started_at
+        self.log.info(
+            f"- Committed chunk {self.chunks}: {count} locations in {elapsed:.2f}s "
+            f"({count / elapsed if elapsed else 0:.0f} locations/s)"
+        )
+
+    def report(self) -> None:
+        elapsed = time.perf_counter() - self._started_at
+        self.log.info(
+            f"Loaded {self.locations} locations from {self.records} records "
+            f"in {self.chunks} chunks and {elapsed:.2f}s "
+            f"({self.records / elapsed if elapsed else 0:.0f} records/s, "
+            f"{self.locations / elapsed if elapsed else 0:.0f} locations/s)"
+        )
+
+
+# ---------------------------------------------------------------
+# Use the `infrahubctl run` command line to execute this script
+#
+#   infrahubctl run bootstrap/load_locations.py file=sites.csv chunk_size=500
+#
+# ---------------------------------------------------------------
+async def run(
+    client: InfrahubClient, log: logging.Logger, branch: str, **kwargs
+) -> None:
+    if "file" not in kwargs:
+        raise ValueError("no file argument provided")
+
+    path = Path(kwargs["file"])
+    chunk_size = int(kwargs.get("chunk_size", DEFAULT_CHUNK_SIZE))
+    cache_size = int(kwargs.get("cache_size", DEFAULT_CACHE_SIZE))
+
+    log.info("Retrieving objects from Infrahub")
+    organizations = {
+        organization.name.value: organization.id
+        for organization in await client.all("OrganizationGeneric", branch=branch)
+    }
+    account_crm = await client.get(
+        kind="CoreAccount",
+        name__value="CRM Synchronization",
+        branch=branch,
+        raise_when_missing=False,
+    )
+
+    loader = LocationStreamLoader(
+        client=client,
+        log=log,
+        branch=branch,
+        organizations=organizations,
+        source_id=account_crm.id if account_crm else None,
+        chunk_size=chunk_size,
+        cache_size=cache_size,
+    )
+
+    log.info(f"Loading locations from {path}")
+    for record in read_records(path):
+        await loader.add_record(record)
+    await loader.flush()
+    loader.report()
@@ -1,7 +1,10 @@
+import asyncio
 import logging
 import ipaddress
 
-from typing import Dict, List, Optional
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional
 
 from infrahub_sdk import InfrahubClient
 from infrahub_sdk.batch import InfrahubBatch
@@ -63,9 +66,12 @@ async def create_ipam_pool(
     batch: Optional[InfrahubBatch] = None,
     location: Optional[str] = None,
     vrf: Optional[str] = None,
+    prefix_obj: Optional[InfrahubNode] = None,
 ) -> InfrahubNode:
     """
     Helper function to create a single IP pool.
+
+    When the prefix has just been allocated, pass it as `prefix_obj` to avoid querying it back.
     """
     default_ip_namespace_obj = await client.get(
         kind="IpamNamespace", name__value="default"
@@ -92,9 +98,10 @@ async def create_ipam_pool(
     }
 
     kind = None
-    prefix_obj = await client.get(
-        kind="InfraPrefix", prefix__value=prefix, raise_when_missing=True
-    )
+    if not prefix_obj:
+        prefix_obj = await client.get(
+            kind="InfraPrefix", prefix__value=prefix, raise_when_missing=True
+        )
     if prefix_obj:
         pool_data["resources"] = [prefix_obj.id]
 
@@ -198,3 +205,83 @@ def populate_local_store(objects: List[InfrahubNode], key_type: str, store: Node
         key = getattr(obj, key_type)
         if key:
             store.set(key=key.value, node=obj)
+
+
+@dataclass
+class PrefixAllocation:
+    identifier: str
+    data: Dict
+    member_type: Optional[str] = None
+    on_allocated: Optional[Callable[[InfrahubNode], Awaitable[None]]] = None
+
+
+class PoolAllocationScheduler:
+    """Allocate prefixes from resource pools, concurrently across pools and in order within a pool.
+
+    Allocations from the same pool are queued in a lane and executed one after the other,
+    so the resulting prefixes are the same as with a serial loop.
+    Lanes run concurrently, bounded by the client's concurrent execution limit.
+    """
+
+    def __init__(self, client: InfrahubClient, log: logging.Logger, branch: str):
+        self.client = client
+        self.log = log
+        self.branch = branch
+        self._pools: Dict[str, InfrahubNode] = {}
+        self._lanes: Dict[str, List[PrefixAllocation]] = defaultdict(list)
+
+    @property
+    def num_allocations(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def add(
+        self,
+        resource_pool: InfrahubNode,
+        identifier: str,
+        data: Dict,
+        member_type: Optional[str] = None,
+        on_allocated: Optional[Callable[[InfrahubNode], Awaitable[None]]] = None,
+    ) -> None:
+        self._pools[resource_pool.id] = resource_pool
+        self._lanes[resource_pool.id].append(
+            PrefixAllocation(
+                identifier=identifier,
+                data=data,
+                member_type=member_type,
+                on_allocated=on_allocated,
+            )
+        )
+
+    async def _execute_lane(self, pool_id: str) -> Dict[str, InfrahubNode]:
+        resource_pool = self._pools[pool_id]
+        allocated = {}
+        for allocation in self._lanes[pool_id]:
+            async with self.client.concurrent_execution_limit:
+                prefix = await self.client.allocate_next_ip_prefix(
+                    resource_pool=resource_pool,
+                    kind="InfraPrefix",
+                    branch=self.branch,
+                    data=allocation.data,
+                    identifier=allocation.identifier,
+                    member_type=allocation.member_type,
+                )
+                await prefix.save()
+            self.log.debug(
+                f"- Allocated {prefix.prefix.value} for '{allocation.identifier}'"
+            )
+            if allocation.on_allocated:
+                await allocation.on_allocated(prefix)
+            allocated[allocation.identifier] = prefix
+        return allocated
+
+    async def execute(self) -> Dict[str, InfrahubNode]:
+        """Run every queued allocation and return the allocated prefixes by identifier."""
+        results = await asyncio.gather(
+            *(self._execute_lane(pool_id) for pool_id in self._lanes)
+        )
+        self._lanes.clear()
+
+        allocated = {}
+        for lane_result in results:
+            allocated.update(lane_result)
+        return allocated
@@ -0,0 +1,109 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from infrahub_sdk.checks import InfrahubCheck
+
+PAGE_SIZE = 1000
+
+
+def endpoint_key(node: dict) -> Tuple[Optional[str], str]:
+    """(device, interface) of an interface, (None, label) of other endpoints like circuit ones."""
+    if node.get("device") and node["device"].get("node"):
+        return node["device"]["node"]["name"]["value"], node["name"]["value"]
+    return None, node.get("display_label") or node["id"]
+
+
+def endpoint_label(key: Tuple[Optional[str], str]) -> str:
+    device, name = key
+    return f"{device}:{name}" if device else name
+
+
+class InfrahubCheckCablingSymmetry(InfrahubCheck):
+    """Every cable must be seen from both of its endpoints.
+
+    All endpoints are indexed by id with their peer, then each cable is
+    checked against the index of its peer:
+    - asymmetric: the peer is connected to another endpoint, or to nothing
+    - dangling: the peer doesn't exist anymore
+    - duplicate: several endpoints are connected to the same peer, or a
+      device has several interfaces with the same name
+    """
+
+    query = "check_cabling_symmetry"
+
+    async def collect_data(self) -> dict:
+        """All the endpoints, read page by page."""
+        edges: List[dict] = []
+        offset = 0
+        while True:
+            data = await self.client.query_gql_query(
+                name=self.query,
+                branch_name=self.branch_name,
+                variables={"offset": offset, "limit": PAGE_SIZE},
+            )
+            data = data.get("data") or data
+            edges.extend(data["InfraEndpoint"]["edges"])
+            offset += PAGE_SIZE
+            if offset >= data["InfraEndpoint"]["count"]:
+                break
+        return {"InfraEndpoint": {"count": len(edges), "edges": edges}}
+
+    def validate(self, data):
+        peers: Dict[str, Optional[str]] = {}
+        keys: Dict[str, Tuple[Optional[str], str]] = {}
+        kinds: Dict[str, str] = {}
+        by_key: Dict[Tuple[Optional[str], str], str] = {}
+        connected_from: Dict[str, List[str]] = defaultdict(list)
+
+        for edge in data["InfraEndpoint"]["edges"]:
+            node = edge["node"]
+            endpoint_id = node["id"]
+            key = endpoint_key(node)
+            keys[endpoint_id] = key
+            kinds[endpoint_id] = node["__typename"]
+            if key[0] and key in by_key:
+                self.log_error(
+                    message=f"Duplicate interface {endpoint_label(key)}",
+                    object_id=endpoint_id,
+                    object_type=node["__typename"],
+                )
+            by_key.setdefault(key, endpoint_id)
+
+            peer = (node.get("connected_endpoint") or {}).get("node")
+            peers[endpoint_id] = peer["id"] if peer else None
+            if peer:
+                connected_from[peer["id"]].append(endpoint_id)
+
+        for endpoint_id, peer_id in peers.items():
+            if not peer_id:
+                continue
+            label = endpoint_label(keys[endpoint_id])
+            if peer_id not in peers:
+                self.log_error(
+                    message=f"Dangling cable on {label}, its peer {peer_id} doesn't exist",
+                    object_id=endpoint_id,
+                    object_type=kinds[endpoint_id],
+                )
+            elif peers[peer_id] != endpoint_id:
+                back_id = peers[peer_id]
+                back_label = (
+                    endpoint_label(keys[back_id]) if back_id in keys else back_id
+                )
+                self.log_error(
+                    message=f"Asymmetric cable on {label}, its peer "
+                    f"{endpoint_label(keys[peer_id])} is connected to {back_label or 'nothing'}",
+                    object_id=endpoint_id,
+                    object_type=kinds[endpoint_id],
+                )
+
+        for peer_id, endpoint_ids in connected_from.items():
+            if len(endpoint_ids) > 1 and peer_id in keys:
+                self.log_error(
+                    message=f"Duplicate cables to {endpoint_label(keys[peer_id])} from "
+                    + ", ".join(
+                        endpoint_label(keys[endpoint_id])
+                        for endpoint_id in endpoint_ids
+                    ),
+                    object_id=peer_id,
+                    object_type=kinds[peer_id],
+                )
@@ -1,93 +1,192 @@
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
 from infrahub_sdk.checks import InfrahubCheck
+from infrahub_sdk.exceptions import GraphQLError
+
+TARGETED_QUERY = "check_device_topology_targeted"
+TOPOLOGY_GROUP_SUFFIX = "_topology"
+
+# Changes to these kinds can affect any topology, they trigger a full sweep
+FULL_SWEEP_KINDS = {"InfraDeviceType"}
 
 
 class InfrahubCheckDeviceTopology(InfrahubCheck):
+    """Validate the devices of topologies against their elements.
+
+    On a branch, only the topologies touched by the branch diff are validated:
+    changed topologies and elements, changed topology groups, and the groups of
+    changed devices. A full sweep runs on the default branch, when the diff
+    can't be read or is empty, when it contains device types, or with
+    `full=true`.
+    """
+
     query = "check_device_topology"
 
-    def validate(self, data):
-        # Extract Topology and Group data
-        topologies = data["TopologyTopology"]["edges"]
-        groups = data["CoreStandardGroup"]["edges"]
-
-        # Map of group names to device IDs
-        group_devices = {
-            group["node"]["name"]["value"]: {
-                edge["node"]["id"]
-                for edge in group["node"]["members"]["edges"]
-                if edge["node"]
+    async def collect_data(self) -> dict:
+        if str(self.params.get("full", "")).lower() in ("1", "true", "yes"):
+            return await self.full_sweep()
+        if self.branch_name == self.client.default_branch:
+            return await self.full_sweep()
+
+        try:
+            topology_names = await self.touched_topologies()
+        except GraphQLError:
+            topology_names = None
+        if topology_names is None:
+            return await self.full_sweep()
+
+        if not topology_names:
+            return {
+                "CoreStandardGroup": {"edges": []},
+                "TopologyTopology": {"edges": []},
             }
+        names = sorted(topology_names)
+        return await self.client.query_gql_query(
+            name=TARGETED_QUERY,
+            branch_name=self.branch_name,
+            variables={
+                "topologies": names,
+                "groups": [f"{name}{TOPOLOGY_GROUP_SUFFIX}" for name in names],
+            },
+        )
+
+    async def full_sweep(self) -> dict:
+        """Query every topology, `full` is a parameter of the check and not a query variable."""
+        return await self.client.query_gql_query(
+            name=self.query,
+            branch_name=self.branch_name,
+            variables={
+                key: value for key, value in self.params.items() if key != "full"
+            },
+        )
+
+    async def touched_topologies(self) -> Optional[Set[str]]:
+        """Names of the topologies affected by the branch diff, None when a full sweep is needed."""
+        node_diffs = await self.client.get_diff_summary(branch=self.branch_name)
+        # The summary is also empty when the diff hasn't been computed yet
+        if not node_diffs:
+            return None
+
+        changed: Dict[str, List[str]] = {}
+        for node_diff in node_diffs:
+            if node_diff["kind"] in FULL_SWEEP_KINDS:
+                return None
+            changed.setdefault(node_diff["kind"], []).append(node_diff["id"])
+
+        names: Set[str] = set()
+        groups = []
+        if changed.get("TopologyTopology"):
+            topologies = await self.client.filters(
+                kind="TopologyTopology",
+                ids=changed["TopologyTopology"],
+                branch=self.branch_name,
+            )
+            names.update(topology.name.value for topology in topologies)
+        element_ids = [
+            node_id
+            for kind, node_ids in changed.items()
+            if kind.startswith("Topology") and kind.endswith("Element")
+            for node_id in node_ids
+        ]
+        if element_ids:
+            topologies = await self.client.filters(
+                kind="TopologyTopology",
+                elements__ids=element_ids,
+                branch=self.branch_name,
+            )
+            names.update(topology.name.value for topology in topologies)
+        if changed.get("CoreStandardGroup"):
+            groups += await self.client.filters(
+                kind="CoreStandardGroup",
+                ids=changed["CoreStandardGroup"],
+                branch=self.branch_name,
+            )
+        if changed.get("InfraDevice"):
+            groups += await self.client.filters(
+                kind="CoreStandardGroup",
+                members__ids=changed["InfraDevice"],
+                branch=self.branch_name,
+            )
+
+        names.update(
+            group.name.value[: -len(TOPOLOGY_GROUP_SUFFIX)]
             for group in groups
-        }
+            if group.name.value.endswith(TOPOLOGY_GROUP_SUFFIX)
+        )
+        return names
 
-        # Map of device IDs to device info
-        device_map = {
-            edge["node"]["id"]: edge["node"] for edge in data["InfraDevice"]["edges"]
+    def validate(self, data):
+        topologies = data["TopologyTopology"]["edges"]
+        group_names = {
+            f"{topology['node']['name']['value']}{TOPOLOGY_GROUP_SUFFIX}"
+            for topology in topologies
         }
 
+        # Role and device type of every device, the targeted query has them in the groups
+        devices: Dict[str, Tuple[str, str]] = {}
+        for edge in data.get("InfraDevice", {}).get("edges", []):
+            devices[edge["node"]["id"]] = device_key(edge["node"])
+
+        # Devices are counted once per (topology group, role, device type), the
+        # types of a role keep the order they were found in for the messages
+        counts: Counter = Counter()
+        found_groups = set()
+        for group in data["CoreStandardGroup"]["edges"]:
+            group_name = group["node"]["name"]["value"]
+            if group_name not in group_names:
+                continue
+            found_groups.add(group_name)
+            for edge in group["node"]["members"]["edges"]:
+                member = edge["node"]
+                if not member:
+                    continue
+                key = devices.get(member["id"])
+                if not key and "role" in member:
+                    key = devices[member["id"]] = device_key(member)
+                if key:
+                    counts[(group_name, *key)] += 1
+
+        types_by_role: Dict[Tuple[str, str], List[str]] = defaultdict(list)
+        for group_name, role, device_type in counts:
+            types_by_role[(group_name, role)].append(device_type)
+
         for topology_edge in topologies:
             topology_node = topology_edge["node"]
             topology_name = topology_node["name"]["value"]
-            group_name = f"{topology_name}_topology"
-
-            if group_name not in group_devices:
+            group_name = f"{topology_name}{TOPOLOGY_GROUP_SUFFIX}"
+            if group_name not in found_groups:
                 self.log_error(
                     message=f"No corresponding group found for topology {topology_name}."
                 )
                 continue
-            group_device_ids = group_devices[group_name]
-            expected_role_device_counts = {}
 
-            # Processing expected roles and device types
+            # The last element wins when several share a role and device type
+            expected: Dict[Tuple[str, str], int] = {}
             for element_edge in topology_node["elements"]["edges"]:
                 element_node = element_edge["node"]
-                role = element_node["device_role"]["value"]
-                device_type = element_node["device_type"]["node"]["name"]["value"]
-                quantity = element_node["quantity"]["value"]
-
-                if role not in expected_role_device_counts:
-                    expected_role_device_counts[role] = {}
-                expected_role_device_counts[role][device_type] = quantity
-
-            # Actual role and device type counts
-            actual_role_device_counts = {}
-            for device_id in group_device_ids:
-                if device_id in device_map:
-                    device = device_map[device_id]
-                    role = device["role"]["value"]
-                    device_type = device["device_type"]["node"]["name"]["value"]
-
-                    if role not in actual_role_device_counts:
-                        actual_role_device_counts[role] = {}
-                    actual_role_device_counts[role][device_type] = (
-                        actual_role_device_counts[role].get(device_type, 0) + 1
-                    )
+                if "device_role" not in element_node:
+                    continue
+                expected[device_key(element_node)] = element_node["quantity"]["value"]
 
-            # Comparison of expected vs actual, including device type check
-            for role, expected_types in expected_role_device_counts.items():
-                for expected_type, expected_count in expected_types.items():
-                    actual_count = actual_role_device_counts.get(role, {}).get(
-                        expected_type, 0
+            for (role, expected_type), expected_count in expected.items():
+                actual_count = counts[(group_name, role, expected_type)]
+                if expected_count % 2 != 0:
+                    self.log_error(
+                        message=f"{topology_name} has an odd number of Elements for role {role}. Expected: {expected_count}"
+                    )
+                if actual_count > 0 and expected_count != actual_count:
+                    self.log_error(
+                        message=f"{topology_name} has mismatched quantity of {expected_type} devices with role {role}. Expected: {expected_count}, Actual: {actual_count}"
                     )
-                    unexpected_types = [
-                        actual_type
-                        for actual_type in actual_role_device_counts.get(role, {})
-                        if actual_type != expected_type
-                    ]
-
-                    if expected_count % 2 != 0:
-                        self.log_error(
-                            message=f"{topology_name} has an odd number of Elements for role {role}. Expected: {expected_count}"
-                        )
-                    if actual_count > 0:
-                        if expected_count != actual_count:
-                            self.log_error(
-                                message=f"{topology_name} has mismatched quantity of {expected_type} devices with role {role}. Expected: {expected_count}, Actual: {actual_count}"
-                            )
-                    if (
-                        expected_type not in actual_role_device_counts.get(role, {})
-                        and unexpected_types
-                    ):
-                        unexpected_types_str = ", ".join(unexpected_types)
-                        self.log_error(
-                            message=f"{topology_name} expected {expected_type} devices with role {role}, but found different type(s): {unexpected_types_str}."
-                        )
+                actual_types = types_by_role.get((group_name, role))
+                if not actual_count and actual_types:
+                    self.log_error(
+                        message=f"{topology_name} expected {expected_type} devices with role {role}, but found different type(s): {', '.join(actual_types)}."
+                    )
+
+
+def device_key(node: dict) -> Tuple[str, str]:
+    """Role and device type of a device or a topology element."""
+    role = node["role"] if "role" in node else node["device_role"]
+    return role["value"], node["device_type"]["node"]["name"]["value"]
@@ -0,0 +1,173 @@
+import socket
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from infrahub_sdk.checks import InfrahubCheck
+
+PAGE_SIZE = 5000
+GLOBAL_VRF = "global"
+
+
+class Entry(NamedTuple):
+    start: int
+    end: int
+    value: str
+    id: str
+    member_type: Optional[str] = None
+    label: Optional[str] = None
+
+
+class Violation(NamedTuple):
+    kind: str
+    vrf: str
+    entry: Entry
+    other: Entry
+
+    def __str__(self) -> str:
+        if self.kind == "duplicate_prefix":
+            return f"Duplicate prefix {self.entry.value} in VRF {self.vrf} ({self.other.id}, {self.entry.id})"
+        if self.kind == "overlapping_prefix":
+            return (
+                f"Prefix {self.entry.value} overlaps {self.other.value} in VRF {self.vrf}, "
+                f"which only holds addresses ({self.entry.id}, {self.other.id})"
+            )
+        labels = ", ".join(
+            f"{entry.id} on {entry.label}" if entry.label else entry.id
+            for entry in (self.other, self.entry)
+        )
+        return f"Duplicate address {self.entry.value} in VRF {self.vrf} ({labels})"
+
+
+def interval(value: str) -> Tuple[int, int, int]:
+    """IP version, first and last address of a prefix or an address with its mask.
+
+    Parsed with inet_pton rather than ipaddress, which is several times slower
+    over millions of records.
+    """
+    address, _, length = value.partition("/")
+    if ":" in address:
+        version, bits, family = 6, 128, socket.AF_INET6
+    else:
+        version, bits, family = 4, 32, socket.AF_INET
+    start = int.from_bytes(socket.inet_pton(family, address), "big")
+    host_mask = (1 << (bits - int(length or bits))) - 1
+    return version, start & ~host_mask, start | host_mask
+
+
+def vrf_name(node: Optional[dict]) -> str:
+    vrf = ((node or {}).get("vrf") or {}).get("node")
+    return vrf["name"]["value"] if vrf else GLOBAL_VRF
+
+
+def find_prefix_violations(vrf: str, prefixes: List[Entry]) -> List[Violation]:
+    """Duplicate and overlapping prefixes of one VRF and IP version, with a single sweep.
+
+    CIDR prefixes either nest or are disjoint, so the prefixes containing the
+    current one are a stack. Nesting is the regular IPAM hierarchy, except
+    under a prefix whose members are addresses.
+    """
+    violations = []
+    stack: List[Entry] = []
+    for entry in sorted(prefixes, key=lambda entry: (entry.start, -entry.end)):
+        while stack and stack[-1].end < entry.start:
+            stack.pop()
+        if stack:
+            parent = stack[-1]
+            if (parent.start, parent.end) == (entry.start, entry.end):
+                violations.append(Violation("duplicate_prefix", vrf, entry, parent))
+                continue
+            if parent.member_type == "address":
+                violations.append(Violation("overlapping_prefix", vrf, entry, parent))
+        stack.append(entry)
+    return violations
+
+
+def find_address_violations(vrf: str, addresses: List[Entry]) -> List[Violation]:
+    """Addresses of one VRF and IP version used more than once."""
+    violations = []
+    previous: Optional[Entry] = None
+    for entry in sorted(addresses, key=lambda entry: entry.start):
+        if previous and previous.start == entry.start:
+            violations.append(Violation("duplicate_address", vrf, entry, previous))
+        else:
+            previous = entry
+    return violations
+
+
+class InfrahubCheckIPOverlap(InfrahubCheck):
+    """Report duplicate and overlapping prefixes and duplicate IP addresses per VRF.
+
+    Addresses belong to the VRF of their parent prefix, prefixes and addresses
+    without a VRF to the global table.
+    """
+
+    query = "check_ip_overlap"
+
+    async def collect_data(self) -> dict:
+        """All the prefixes and addresses, read page by page."""
+        edges: Dict[str, List[dict]] = {"InfraPrefix": [], "InfraIPAddress": []}
+        offset = 0
+        while True:
+            data = await self.client.query_gql_query(
+                name=self.query,
+                branch_name=self.branch_name,
+                variables={"offset": offset, "limit": PAGE_SIZE},
+            )
+            data = data.get("data") or data
+            for kind in edges:
+                edges[kind].extend(data[kind]["edges"])
+            offset += PAGE_SIZE
+            if offset >= max(data[kind]["count"] for kind in edges):
+                break
+        return {kind: {"edges": kind_edges} for kind, kind_edges in edges.items()}
+
+    def validate(self, data):
+        prefixes: Dict[Tuple[str, int], List[Entry]] = defaultdict(list)
+        for edge in data["InfraPrefix"]["edges"]:
+            node = edge["node"]
+            version, start, end = interval(node["prefix"]["value"])
+            prefixes[(vrf_name(node), version)].append(
+                Entry(
+                    start,
+                    end,
+                    node["prefix"]["value"],
+                    node["id"],
+                    (node.get("member_type") or {}).get("value"),
+                )
+            )
+
+        addresses: Dict[Tuple[str, int], List[Entry]] = defaultdict(list)
+        for edge in data["InfraIPAddress"]["edges"]:
+            node = edge["node"]
+            address = node["address"]["value"].partition("/")[0]
+            version, start, _ = interval(address)
+            interface = (node.get("interface") or {}).get("node")
+            addresses[
+                (vrf_name((node.get("ip_prefix") or {}).get("node")), version)
+            ].append(
+                Entry(
+                    start,
+                    start,
+                    address,
+                    node["id"],
+                    label=interface["display_label"] if interface else None,
+                )
+            )
+
+        violations = [
+            violation
+            for (vrf, _), entries in prefixes.items()
+            for violation in find_prefix_violations(vrf, entries)
+        ] + [
+            violation
+            for (vrf, _), entries in addresses.items()
+            for violation in find_address_violations(vrf, entries)
+        ]
+        for violation in violations:
+            self.log_error(
+                message=str(violation),
+                object_id=violation.entry.id,
+                object_type="InfraIPAddress"
+                if violation.kind == "duplicate_address"
+                else "InfraPrefix",
+            )
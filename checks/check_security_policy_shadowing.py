@@ -0,0 +1,30 @@
+from infrahub_sdk.checks import InfrahubCheck
+
+from generators.security_rule_matcher import SecurityObjectResolver, find_dead_rules
+
+
+class InfrahubCheckSecurityPolicyShadowing(InfrahubCheck):
+    query = "check_security_policy_shadowing"
+
+    def validate(self, data):
+        resolver = SecurityObjectResolver()
+        resolver.load_graphql(data)
+
+        for device_edge in data["SecurityFirewall"]["edges"]:
+            device_name = device_edge["node"]["name"]["value"]
+            try:
+                rules = [
+                    resolver.match_rule_from_graphql(rule_edge["node"])
+                    for rule_edge in device_edge["node"]["rules"]["edges"]
+                ]
+            except ValueError as exc:
+                # Nested groups referencing each other can't be flattened
+                self.log_error(message=f"{device_name}: {exc}")
+                continue
+
+            # Shadowed rules hide an intent, redundant ones are only dead weight
+            for finding in find_dead_rules(rules):
+                if finding.kind == "shadowed":
+                    self.log_error(message=f"{device_name}: {finding}")
+                else:
+                    self.log_info(message=f"{device_name}: {finding}")
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from infrahub_sdk import InfrahubClient
+from infrahub_sdk.node import InfrahubNode
+
+
+class LocationIndex:
+    """Materialized view of the location tree, built from a single bulk query.
+
+    Every location keeps its path from the root and the range of its descendants
+    in a pre-order walk of the tree. Ancestors are read from the stored path and
+    the devices of a subtree are a contiguous slice of a flat device list.
+    """
+
+    def __init__(self, locations: List[InfrahubNode]):
+        self.nodes: Dict[str, InfrahubNode] = {
+            location.id: location for location in locations
+        }
+        self._paths: Dict[str, Tuple[str, ...]] = {}
+        self._ranges: Dict[str, Tuple[int, int]] = {}
+        self._preorder: List[str] = []
+        self._device_offsets: List[int] = []
+        self._device_ids: List[str] = []
+
+        children: Dict[Optional[str], List[InfrahubNode]] = defaultdict(list)
+        for location in locations:
+            parent_id = self.parent_id(location)
+            children[parent_id if parent_id in self.nodes else None].append(location)
+        for siblings in children.values():
+            siblings.sort(key=lambda location: location.name.value)
+
+        # Iterative pre-order walk, a location is closed once all its children are
+        stack: List[Tuple[InfrahubNode, bool]] = [
+            (root, False) for root in reversed(children[None])
+        ]
+        while stack:
+            location, closing = stack.pop()
+            if closing:
+                self._ranges[location.id] = (
+                    self._ranges[location.id][0],
+                    len(self._preorder),
+                )
+                continue
+
+            parent_id = self.parent_id(location)
+            parent_path = self._paths.get(parent_id, ()) if parent_id else ()
+            self._paths[location.id] = parent_path + (location.id,)
+            self._ranges[location.id] = (len(self._preorder), len(self._preorder))
+            self._preorder.append(location.id)
+            self._device_offsets.append(len(self._device_ids))
+            if hasattr(location, "devices"):
+                self._device_ids.extend(peer.id for peer in location.devices.peers)
+
+            stack.append((location, True))
+            stack.extend((child, False) for child in reversed(children[location.id]))
+        self._device_offsets.append(len(self._device_ids))
+
+    @classmethod
+    async def from_client(
+        cls, client: InfrahubClient, branch: Optional[str] = None
+    ) -> LocationIndex:
+        locations = await client.all(
+            kind="LocationGeneric", branch=branch, include=["devices"]
+        )
+        return cls(locations=locations)
+
+    @staticmethod
+    def parent_id(location: InfrahubNode) -> Optional[str]:
+        if hasattr(location, "parent") and location.parent.id:
+            return location.parent.id
+        return None
+
+    def __contains__(self, location_id: str) -> bool:
+        return location_id in self.nodes
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def get(self, location_id: str) -> InfrahubNode:
+        return self.nodes[location_id]
+
+    def path(self, location_id: str) -> Tuple[str, ...]:
+        """IDs from the root down to the location itself."""
+        return self._paths[location_id]
+
+    def ancestors(self, location_id: str) -> Tuple[str, ...]:
+        """IDs of the ancestors of a location, from the root down to its parent."""
+        return self._paths[location_id][:-1]
+
+    def is_ancestor(self, ancestor_id: str, location_id: str) -> bool:
+        start, end = self._ranges[ancestor_id]
+        return start < self._ranges[location_id][0] < end
+
+    def descendants(self, location_id: str) -> List[str]:
+        """IDs of the descendants of a location in pre-order."""
+        start, end = self._ranges[location_id]
+        return self._preorder[start + 1 : end]
+
+    def device_ids(self, location_id: str) -> List[str]:
+        """IDs of the devices attached to a location or to any of its descendants."""
+        start, end = self._ranges[location_id]
+        return self._device_ids[self._device_offsets[start] : self._device_offsets[end]]
@@ -1,11 +1,27 @@
 from __future__ import annotations
 
+import asyncio
+import ipaddress
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from git.exc import InvalidGitRepositoryError, NoSuchPathError
+from git.repo import Repo
 from infrahub_sdk import InfrahubClient
 from infrahub_sdk.generator import InfrahubGenerator
+from infrahub_sdk.node import InfrahubNode
+from infrahub_sdk.query_groups import InfrahubGroupContext
 
 # Usage:
 # -----
 # CLI : infrahubctl generator generate_network_services network_service_name="aabbcc" --branch main
+# Bulk: infrahubctl run generators/network_services.py group=network_services --branch main
 #
 # UI :
 # - Create a branch
@@ -20,24 +36,445 @@ L2_VLAN_NAME_PREFIX = "l2"
 L3_VLAN_NAME_PREFIX = "l3"
 VRF_SERVER = "Production"
 ORGANISATION = "Duff"
+LOOKUP_CACHE_TTL = 300.0
+VLAN_NAME_PREFIXES = {
+    "TopologyLayer2NetworkService": L2_VLAN_NAME_PREFIX,
+    "TopologyLayer3NetworkService": L3_VLAN_NAME_PREFIX,
+}
+NETWORK_SERVICES_GROUP = "network_services"
+# Name of the generator definition in .infrahub.yml, its groups are named after it
+GENERATOR_NAME = "generate_network_services"
+BULK_QUERY_PATH = Path(__file__).parent / "network_services_bulk.gql"
+
+
+class LookupCache:
+    """Cache of the objects every run looks up (pools, VRF, tenant), shared by the runs of a worker.
+
+    Entries are keyed by branch, a cache token (the commit of the repository the
+    generator runs from) and the lookup itself, and expire after `ttl` seconds.
+    Missing objects aren't cached so they are picked up as soon as they exist.
+    """
+
+    def __init__(self, ttl: float = LOOKUP_CACHE_TTL):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: Dict[Tuple, Tuple[float, InfrahubNode]] = {}
+
+    async def get(
+        self,
+        client: InfrahubClient,
+        kind: str,
+        branch: Optional[str] = None,
+        token: str = "",
+        **filters: Any,
+    ) -> Optional[InfrahubNode]:
+        key = (branch, token, kind, tuple(sorted(filters.items())))
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry and now - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        node = await client.get(
+            kind=kind, branch=branch, raise_when_missing=False, **filters
+        )
+        if node:
+            self._entries[key] = (now, node)
+        else:
+            self._entries.pop(key, None)
+        return node
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    @property
+    def metrics(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses, {len(self._entries)} entries"
+
+
+# Module level, so it lives as long as the worker process
+LOOKUP_CACHE = LookupCache()
+
+
+# ---------------------------------------------------------------
+# Pool capacity
+#
+# Utilization of the prefix and VLAN pools is computed in one pass: allocated
+# prefixes and VLAN IDs are sorted once, then each pool subtracts the merged
+# intervals it contains from its own range. The free space is counted in
+# allocations of the pool's size (aligned blocks of the default prefix
+# length, single VLAN IDs), so fragmentation is taken into account.
+#
+# Before allocating, the generator warns or refuses, as per CAPACITY_POLICY,
+# when a pool can't serve what the run needs, and warns when a pool is left
+# with less than CAPACITY_WARNING_HEADROOM of its size. Only the pools of the
+# run are read, along with the prefixes directly under their resources and the
+# VLANs of their locations. The policy is set per worker with
+#
+#   NETWORK_SERVICES_CAPACITY_POLICY=refuse
+#
+# and per bulk run with capacity_policy=refuse.
+# ---------------------------------------------------------------
+
+CAPACITY_POLICY = os.environ.get(
+    "NETWORK_SERVICES_CAPACITY_POLICY", "warn"
+)  # "warn", "refuse" or "off"
+CAPACITY_TTL = 60.0
+CAPACITY_PAGE_SIZE = 1000
+# Warn when less than this share of a pool is left after the run
+CAPACITY_WARNING_HEADROOM = 0.1
+
+# Fields read per kind, and the filter and variable type scoping a run to its pools
+CAPACITY_SELECTIONS = {
+    "CoreIPPrefixPool": """
+        name { value }
+        default_prefix_length { value }
+        resources { edges { node { id ... on BuiltinIPPrefix { prefix { value } } } } }
+    """,
+    "CoreNumberPool": """
+        name { value }
+        node { value }
+        start_range { value }
+        end_range { value }
+    """,
+    "InfraPrefix": "prefix { value }",
+    "InfraVLAN": """
+        vlan_id { value }
+        location { node { shortname { value } } }
+    """,
+}
+CAPACITY_SCOPES = {
+    "CoreIPPrefixPool": ("name__values", "[String]"),
+    "CoreNumberPool": ("name__values", "[String]"),
+    # Prefixes are placed under their closest parent, so the direct children
+    # of a resource cover everything allocated from it
+    "InfraPrefix": ("parent__ids", "[ID]"),
+    "InfraVLAN": ("location__ids", "[ID]"),
+}
+
+Interval = Tuple[int, int]
+
+
+class PoolCapacityError(ValueError):
+    pass
+
+
+class AllocationError(ValueError):
+    pass
+
+
+@dataclass
+class PoolCapacity:
+    name: str
+    kind: str
+    size: int
+    remaining: int
+
+    @property
+    def utilization(self) -> float:
+        return 1 - self.remaining / self.size if self.size else 1.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name}: {self.utilization:.0%} used, "
+            f"{self.remaining} of {self.size} allocations left"
+        )
+
+
+def capacity_query(kind: str, scoped: bool = False) -> str:
+    """Paginated query of the capacity fields of a kind, filtered by $scope if scoped."""
+    scope_filter, scope_type = CAPACITY_SCOPES[kind]
+    variables = "$offset: Int, $limit: Int"
+    arguments = "offset: $offset, limit: $limit"
+    if scoped:
+        variables += f", $scope: {scope_type}"
+        arguments += f", {scope_filter}: $scope"
+    return f"""
+        query({variables}) {{
+          {kind}({arguments}) {{
+            count
+            edges {{ node {{ {CAPACITY_SELECTIONS[kind]} }} }}
+          }}
+        }}
+    """
+
+
+def merge_intervals(intervals: List[Interval]) -> List[Interval]:
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def free_intervals(start: int, end: int, used: List[Interval]) -> List[Interval]:
+    """Subtract merged, sorted intervals from [start, end]."""
+    free = []
+    cursor = start
+    for used_start, used_end in used:
+        if used_end < cursor or used_start > end:
+            continue
+        if used_start > cursor:
+            free.append((cursor, used_start - 1))
+        cursor = max(cursor, used_end + 1)
+    if cursor <= end:
+        free.append((cursor, end))
+    return free
+
+
+def aligned_blocks(start: int, end: int, block_size: int) -> int:
+    """Number of aligned blocks of `block_size` fitting in [start, end]."""
+    return max(0, (end + 1) // block_size - (start + block_size - 1) // block_size)
+
+
+def compute_pool_capacities(data: Dict[str, List[dict]]) -> Dict[str, PoolCapacity]:
+    """Compute the capacity of every pool from the nodes returned by the capacity queries."""
+    capacities: Dict[str, PoolCapacity] = {}
+
+    # Prefixes sorted per IP version by (start, end), so the ones inside a
+    # resource are a contiguous run found with a bisect
+    prefixes: Dict[int, List[Tuple[int, int, int]]] = defaultdict(list)
+    for node in data["InfraPrefix"]:
+        network = ipaddress.ip_network(node["prefix"]["value"], strict=False)
+        prefixes[network.version].append(
+            (
+                int(network.network_address),
+                int(network.broadcast_address),
+                network.prefixlen,
+            )
+        )
+    for version_prefixes in prefixes.values():
+        version_prefixes.sort()
+
+    for node in data["CoreIPPrefixPool"]:
+        name = node["name"]["value"]
+        prefix_length = node["default_prefix_length"]["value"]
+        size = remaining = 0
+        for edge in node["resources"]["edges"]:
+            if not edge["node"] or "prefix" not in edge["node"]:
+                continue
+            resource = ipaddress.ip_network(
+                edge["node"]["prefix"]["value"], strict=False
+            )
+            start, end = int(resource.network_address), int(resource.broadcast_address)
+            candidates = prefixes[resource.version]
+            used = []
+            position = bisect_left(candidates, (start, start, -1))
+            while position < len(candidates) and candidates[position][0] <= end:
+                prefix_start, prefix_end, prefixlen = candidates[position]
+                if prefix_end <= end and prefixlen > resource.prefixlen:
+                    used.append((prefix_start, prefix_end))
+                position += 1
+
+            block_size = 2 ** (
+                resource.max_prefixlen - (prefix_length or resource.prefixlen)
+            )
+            size += aligned_blocks(start, end, block_size)
+            remaining += sum(
+                aligned_blocks(free_start, free_end, block_size)
+                for free_start, free_end in free_intervals(
+                    start, end, merge_intervals(used)
+                )
+            )
+        capacities[name] = PoolCapacity(
+            name=name, kind="CoreIPPrefixPool", size=size, remaining=remaining
+        )
+
+    # VLANs of a location are allocated from its vlans-<site> pool
+    vlans: Dict[Optional[str], List[int]] = defaultdict(list)
+    for node in data["InfraVLAN"]:
+        location = (node.get("location") or {}).get("node")
+        site = location["shortname"]["value"].lower() if location else None
+        vlans[site].append(node["vlan_id"]["value"])
+
+    for node in data["CoreNumberPool"]:
+        if node["node"]["value"] != "InfraVLAN":
+            continue
+        name = node["name"]["value"]
+        start, end = node["start_range"]["value"], node["end_range"]["value"]
+        if name.startswith("vlans-"):
+            pool_vlans = vlans.get(name[len("vlans-") :], [])
+        else:
+            pool_vlans = [vlan for site_vlans in vlans.values() for vlan in site_vlans]
+        used = merge_intervals(
+            [(vlan_id, vlan_id) for vlan_id in pool_vlans if start <= vlan_id <= end]
+        )
+        capacities[name] = PoolCapacity(
+            name=name,
+            kind="CoreNumberPool",
+            size=end - start + 1,
+            remaining=sum(
+                free_end - free_start + 1
+                for free_start, free_end in free_intervals(start, end, used)
+            ),
+        )
+    return capacities
+
+
+async def fetch_nodes(
+    client: InfrahubClient,
+    kind: str,
+    branch: Optional[str] = None,
+    scope: Optional[List[str]] = None,
+) -> List[dict]:
+    """Read every node of a kind, or the ones matching the scope, one page at a time."""
+    nodes: List[dict] = []
+    if scope is not None and not scope:
+        return nodes
+    query = capacity_query(kind, scoped=scope is not None)
+    offset = 0
+    while True:
+        variables: Dict[str, Any] = {"offset": offset, "limit": CAPACITY_PAGE_SIZE}
+        if scope is not None:
+            variables["scope"] = scope
+        response = await client.execute_graphql(
+            query=query, branch_name=branch, variables=variables
+        )
+        nodes.extend(edge["node"] for edge in response[kind]["edges"])
+        offset += CAPACITY_PAGE_SIZE
+        if offset >= response[kind]["count"]:
+            return nodes
+
+
+async def fetch_pool_capacities(
+    client: InfrahubClient,
+    branch: Optional[str] = None,
+    pools: Optional[List[str]] = None,
+    location_ids: Optional[List[str]] = None,
+) -> Dict[str, PoolCapacity]:
+    """Compute the capacity of the pools named, or of every pool if none are.
+
+    When scoped, the prefixes are read under the resources of the prefix pools
+    and the VLANs of the locations given, instead of all of them.
+    """
+    data: Dict[str, List[dict]] = {}
+    for kind in ("CoreIPPrefixPool", "CoreNumberPool"):
+        data[kind] = await fetch_nodes(client, kind, branch=branch, scope=pools)
+    resource_ids = None
+    if pools is not None:
+        resource_ids = [
+            edge["node"]["id"]
+            for node in data["CoreIPPrefixPool"]
+            for edge in node["resources"]["edges"]
+            if edge["node"]
+        ]
+        location_ids = location_ids or []
+    data["InfraPrefix"] = await fetch_nodes(
+        client, "InfraPrefix", branch=branch, scope=resource_ids
+    )
+    data["InfraVLAN"] = await fetch_nodes(
+        client, "InfraVLAN", branch=branch, scope=location_ids
+    )
+    return compute_pool_capacities(data)
+
+
+_CAPACITY_CACHE: Dict[Tuple, Tuple[float, Dict[str, PoolCapacity]]] = {}
+
+
+async def get_pool_capacities(
+    client: InfrahubClient,
+    branch: Optional[str] = None,
+    pools: Optional[List[str]] = None,
+    location_ids: Optional[List[str]] = None,
+) -> Dict[str, PoolCapacity]:
+    """Pool capacities of a branch, recomputed at most every CAPACITY_TTL seconds per worker."""
+    key = (
+        branch,
+        tuple(sorted(pools)) if pools is not None else None,
+        tuple(sorted(location_ids or [])),
+    )
+    now = time.monotonic()
+    entry = _CAPACITY_CACHE.get(key)
+    if entry and now - entry[0] < CAPACITY_TTL:
+        return entry[1]
+    capacities = await fetch_pool_capacities(
+        client, branch=branch, pools=pools, location_ids=location_ids
+    )
+    _CAPACITY_CACHE[key] = (now, capacities)
+    return capacities
+
+
+def forget_pool_capacities(branch: Optional[str] = None) -> None:
+    """Drop the cached capacities of a branch, once its pools served allocations."""
+    for key in [key for key in _CAPACITY_CACHE if key[0] == branch]:
+        del _CAPACITY_CACHE[key]
+
+
+async def check_pool_capacity(
+    client: InfrahubClient,
+    needs: Dict[str, int],
+    branch: Optional[str] = None,
+    policy: str = CAPACITY_POLICY,
+    location_ids: Optional[List[str]] = None,
+) -> None:
+    """Warn, or refuse with a PoolCapacityError, when pools can't serve the allocations needed.
+
+    `location_ids` are the locations of the VLAN pools in `needs`.
+    """
+    if policy == "off" or not needs:
+        return
+    capacities = await get_pool_capacities(
+        client, branch=branch, pools=list(needs), location_ids=location_ids
+    )
+    for pool_name, needed in needs.items():
+        capacity = capacities.get(pool_name)
+        if not capacity:
+            continue
+        if capacity.remaining < needed:
+            message = f"Pool {capacity} but {needed} are needed"
+            if policy == "refuse":
+                raise PoolCapacityError(message)
+            client.log.warning(message)
+        elif capacity.remaining - needed < capacity.size * CAPACITY_WARNING_HEADROOM:
+            client.log.warning(f"Pool {capacity}, {needed} more are needed")
 
 
 async def allocate_prefix(
     client: InfrahubClient,
     network_service,
     location,
-) -> None:
-    """Allocate a prefix coming from a resource pool to the service."""
+    branch: Optional[str] = None,
+    cache_token: str = "",
+) -> Optional[InfrahubNode]:
+    """Allocate a prefix coming from a resource pool to the service, None if the pool, VRF or tenant is missing."""
 
     location_shortname = location["shortname"]["value"]
     network_service_name = network_service["name"]["value"]
     # Get resource pool
-    resource_pool = await client.get(
+    resource_pool = await LOOKUP_CACHE.get(
+        client,
         kind="CoreIPPrefixPool",
+        branch=branch,
+        token=cache_token,
         name__value=f"supernet-{location_shortname.lower()}",
     )
-    vrf = await client.get(kind="InfraVRF", name__value="Production")
-    org = await client.get(kind="OrganizationTenant", name__value="Duff")
+    vrf = await LOOKUP_CACHE.get(
+        client,
+        kind="InfraVRF",
+        branch=branch,
+        token=cache_token,
+        name__value=VRF_SERVER,
+    )
+    org = await LOOKUP_CACHE.get(
+        client,
+        kind="OrganizationTenant",
+        branch=branch,
+        token=cache_token,
+        name__value=ORGANISATION,
+    )
+    if not resource_pool or not vrf or not org:
+        client.log.error(
+            f"Failed to find Pool supernet-{location_shortname.lower()}, "
+            f"VRF {VRF_SERVER} or Organization {ORGANISATION}"
+        )
+        return None
 
     # Craft the data dict for prefix
     prefix_data: dict = {
@@ -58,6 +495,7 @@ async def allocate_prefix(
         member_type="address",
     )
     await prefix.save(allow_upsert=True)
+    return prefix
 
 
 async def allocate_vlan(
@@ -65,20 +503,27 @@ async def allocate_vlan(
     vlan_name_prefix: str,
     network_service,
     location,
-) -> None:
-    """Create a VLAN with ID coming from the pool provided and assign this VLAN to the service."""
+    branch: Optional[str] = None,
+    cache_token: str = "",
+) -> Optional[InfrahubNode]:
+    """Create a VLAN with ID coming from the pool provided and assign this VLAN to the service.
+
+    Returns None if the pool is missing.
+    """
 
     location_shortname = location["shortname"]["value"]
     network_service_name = network_service["name"]["value"]
     # Get resource pool
-    resource_pool = await client.get(
+    resource_pool = await LOOKUP_CACHE.get(
+        client,
         kind="CoreNumberPool",
+        branch=branch,
+        token=cache_token,
         name__value=f"vlans-{location_shortname.lower()}",
-        raise_when_missing=False,
     )
     if not resource_pool:
-        print(f"Failed to find Pool with vlans-{location_shortname.lower()}")
-        return
+        client.log.error(f"Failed to find Pool with vlans-{location_shortname.lower()}")
+        return None
 
     # Craft and save the vlan
     vlan = await client.create(
@@ -91,34 +536,308 @@ async def allocate_vlan(
         location=location["id"],
     )
     await vlan.save(allow_upsert=True)
+    return vlan
+
+
+@dataclass
+class ServiceAllocation:
+    vlan_allocated: bool = False
+    prefix_allocated: bool = False
+    # Resources that couldn't be allocated, "vlan" or "prefix"
+    missing: List[str] = field(default_factory=list)
+    # IDs of the VLAN and prefix of the service, existing or allocated
+    node_ids: List[str] = field(default_factory=list)
+
+    @property
+    def noop(self) -> bool:
+        return (
+            not self.vlan_allocated and not self.prefix_allocated and not self.missing
+        )
+
+    def __str__(self) -> str:
+        return f"no {' or '.join(self.missing)} allocated"
+
+
+@dataclass
+class RunStats:
+    runs: int = 0
+    noop_runs: int = 0
+    failed_runs: int = 0
+
+    def record(self, allocation: ServiceAllocation) -> None:
+        self.runs += 1
+        if allocation.noop:
+            self.noop_runs += 1
+        if allocation.missing:
+            self.failed_runs += 1
+
+    def __str__(self) -> str:
+        return (
+            f"{self.noop_runs} of {self.runs} runs were no-ops, "
+            f"{self.failed_runs} failed"
+        )
+
+
+# Module level, like the lookup cache, to report over the life of the worker
+RUN_STATS = RunStats()
+
+
+def existing_allocation_id(network_service, relationship: str) -> Optional[str]:
+    """ID of the VLAN or prefix already assigned to the service in the query data."""
+    related = network_service.get(relationship) or {}
+    return (related.get("node") or {}).get("id")
+
+
+async def generate_network_service(
+    client: InfrahubClient,
+    network_service,
+    branch: Optional[str] = None,
+    cache_token: str = "",
+    check_capacity: bool = True,
+) -> ServiceAllocation:
+    """Allocate the VLAN, and the prefix of a layer 3 service, of one network service.
+
+    Allocations already visible in the query data are skipped, but still reported
+    to the generator group so the tracking doesn't delete them. The pools are
+    checked for capacity first, unless the caller already did it for a whole run.
+    """
+    allocation = ServiceAllocation()
+    vlan_name_prefix = VLAN_NAME_PREFIXES.get(network_service["__typename"])
+    if not vlan_name_prefix:
+        # This Generator doesn't support other type of NetworkService
+        return allocation
+    location = network_service["topology"]["node"]["location"]["node"]
+    location_shortname = location["shortname"]["value"].lower()
+
+    existing_ids = []
+    needs: Dict[str, int] = {}
+    # Resource name to the coroutine allocating it
+    tasks = {}
+    vlan_id = existing_allocation_id(network_service, "vlan")
+    if vlan_id:
+        existing_ids.append(vlan_id)
+    else:
+        needs[f"vlans-{location_shortname}"] = 1
+        tasks["vlan"] = allocate_vlan(
+            client=client,
+            vlan_name_prefix=vlan_name_prefix,
+            network_service=network_service,
+            location=location,
+            branch=branch,
+            cache_token=cache_token,
+        )
+
+    if network_service["__typename"] == "TopologyLayer3NetworkService":
+        prefix_id = existing_allocation_id(network_service, "prefix")
+        if prefix_id:
+            existing_ids.append(prefix_id)
+        else:
+            needs[f"supernet-{location_shortname}"] = 1
+            tasks["prefix"] = allocate_prefix(
+                client=client,
+                network_service=network_service,
+                location=location,
+                branch=branch,
+                cache_token=cache_token,
+            )
+
+    if existing_ids:
+        await client.group_context.add_related_nodes(ids=existing_ids)
+    allocation.node_ids.extend(existing_ids)
+    if check_capacity:
+        await check_pool_capacity(
+            client, needs, branch=branch, location_ids=[location["id"]]
+        )
+    # VLAN and prefix come from different pools, nothing orders them
+    try:
+        nodes = await asyncio.gather(*tasks.values())
+    finally:
+        if tasks:
+            forget_pool_capacities(branch)
+    for resource, node in zip(tasks, nodes):
+        if node:
+            allocation.node_ids.append(node.id)
+        else:
+            allocation.missing.append(resource)
+    allocation.vlan_allocated = "vlan" in tasks and "vlan" not in allocation.missing
+    allocation.prefix_allocated = (
+        "prefix" in tasks and "prefix" not in allocation.missing
+    )
+    return allocation
 
 
 class NetworkServicesGenerator(InfrahubGenerator):
+    @property
+    def cache_token(self) -> str:
+        """Commit of the repository the generator runs from, empty outside of a git repository."""
+        try:
+            return Repo(self.root_directory).head.commit.hexsha
+        except (InvalidGitRepositoryError, NoSuchPathError, ValueError):
+            return ""
+
     async def generate(self, data: dict) -> None:
         if not len(data["TopologyNetworkService"]["edges"]):
             return
-        network_service_node = data["TopologyNetworkService"]["edges"][0]["node"]
-        topology_node = network_service_node["topology"]["node"]
-        location_node = topology_node["location"]["node"]
-
-        if network_service_node["__typename"] == "TopologyLayer2NetworkService":
-            vlan_name_prefix = L2_VLAN_NAME_PREFIX
-        elif network_service_node["__typename"] == "TopologyLayer3NetworkService":
-            vlan_name_prefix = L3_VLAN_NAME_PREFIX
-        else:
-            # This Generator doesn't support other type of NetworkService
-            return
-
-        await allocate_vlan(
+        network_service = data["TopologyNetworkService"]["edges"][0]["node"]
+        allocation = await generate_network_service(
             client=self.client,
-            vlan_name_prefix=vlan_name_prefix,
-            network_service=network_service_node,
-            location=location_node,
+            network_service=network_service,
+            branch=self.branch_name,
+            cache_token=self.cache_token,
+        )
+        RUN_STATS.record(allocation)
+        self.client.log.info(f"Lookup cache: {LOOKUP_CACHE}, {RUN_STATS}")
+        if allocation.missing:
+            # Fail the run, the service is left without the resources it needs
+            raise AllocationError(f"{network_service['name']['value']}: {allocation}")
+        if allocation.noop:
+            self.client.log.info(
+                "Nothing to allocate, the service already has its resources"
+            )
+
+
+# ---------------------------------------------------------------
+# Bulk mode, for onboarding a whole group of services at once
+#
+#   infrahubctl run generators/network_services.py group=network_services
+#
+# All the services of the group are read with a single query, the pools of
+# every location are looked up once, then all the services are allocated
+# through one batch. The VLAN and prefix of every service are then added to
+# the generator group the regular generator would have tracked them in, so
+# its next run on a proposed change keeps them instead of deleting them.
+#
+# The capacity of every pool is reported with
+#
+#   infrahubctl run generators/network_services.py mode=capacity
+# ---------------------------------------------------------------
+async def track_service_nodes(
+    client: InfrahubClient, network_service, node_ids: List[str]
+) -> None:
+    """Add the nodes of a service to its generator group, as a generator run would."""
+    group_context = InfrahubGroupContext(client)
+    group_context.set_properties(
+        identifier=GENERATOR_NAME,
+        params={"network_service_name": network_service["name"]["value"]},
+        group_type="CoreGeneratorGroup",
+    )
+    await group_context.add_related_nodes(ids=node_ids, update_group_context=True)
+    await group_context.update_group()
+
+
+async def report_capacity(
+    client: InfrahubClient, log: logging.Logger, branch: str
+) -> None:
+    capacities = await fetch_pool_capacities(client, branch=branch)
+    for capacity in sorted(
+        capacities.values(), key=lambda capacity: capacity.utilization, reverse=True
+    ):
+        log.info(f"- {capacity}")
+
+
+async def run(
+    client: InfrahubClient, log: logging.Logger, branch: str, **kwargs
+) -> None:
+    if kwargs.get("mode") == "capacity":
+        await report_capacity(client, log, branch)
+        return
+    group_name = kwargs.get("group", NETWORK_SERVICES_GROUP)
+
+    started_at = time.perf_counter()
+    data = await client.execute_graphql(
+        query=BULK_QUERY_PATH.read_text(),
+        branch_name=branch,
+        variables={"group": group_name},
+    )
+    network_services = [
+        edge["node"]
+        for group in data["CoreStandardGroup"]["edges"]
+        for edge in group["node"]["members"]["edges"]
+        if edge["node"]["__typename"] in VLAN_NAME_PREFIXES
+    ]
+    services_by_location: Dict[str, List[dict]] = defaultdict(list)
+    for network_service in network_services:
+        location = network_service["topology"]["node"]["location"]["node"]
+        services_by_location[location["shortname"]["value"].lower()].append(
+            network_service
         )
+    log.info(
+        f"Found {len(network_services)} services in {len(services_by_location)} "
+        f"locations in group {group_name}"
+    )
 
-        if network_service_node["__typename"] == "TopologyLayer3NetworkService":
-            await allocate_prefix(
-                client=self.client,
-                network_service=network_service_node,
-                location=location_node,
+    # Shared lookups first, so the batch only hits the cache
+    for kind, name in [("InfraVRF", VRF_SERVER), ("OrganizationTenant", ORGANISATION)]:
+        await LOOKUP_CACHE.get(client, kind=kind, branch=branch, name__value=name)
+    for location_shortname in services_by_location:
+        await LOOKUP_CACHE.get(
+            client,
+            kind="CoreNumberPool",
+            branch=branch,
+            name__value=f"vlans-{location_shortname}",
+        )
+        await LOOKUP_CACHE.get(
+            client,
+            kind="CoreIPPrefixPool",
+            branch=branch,
+            name__value=f"supernet-{location_shortname}",
+        )
+
+    # Every pool is checked once against what the whole group needs
+    needs: Dict[str, int] = defaultdict(int)
+    location_ids = set()
+    for location_shortname, location_services in services_by_location.items():
+        for network_service in location_services:
+            if not existing_allocation_id(network_service, "vlan"):
+                needs[f"vlans-{location_shortname}"] += 1
+                location_ids.add(
+                    network_service["topology"]["node"]["location"]["node"]["id"]
+                )
+            layer3 = network_service["__typename"] == "TopologyLayer3NetworkService"
+            if layer3 and not existing_allocation_id(network_service, "prefix"):
+                needs[f"supernet-{location_shortname}"] += 1
+    await check_pool_capacity(
+        client,
+        needs,
+        branch=branch,
+        policy=kwargs.get("capacity_policy", CAPACITY_POLICY),
+        location_ids=sorted(location_ids),
+    )
+
+    batch = await client.create_batch()
+    for location_services in services_by_location.values():
+        for network_service in location_services:
+            batch.add(
+                task=generate_network_service,
+                node=network_service,
+                client=client,
+                network_service=network_service,
+                branch=branch,
+                check_capacity=False,
+            )
+    noop_services = 0
+    failed_services = 0
+    tracking = await client.create_batch()
+    async for network_service, allocation in batch.execute():
+        if allocation.noop:
+            noop_services += 1
+        if allocation.missing:
+            failed_services += 1
+            log.error(f"- {network_service['name']['value']}: {allocation}")
+        if allocation.node_ids:
+            tracking.add(
+                task=track_service_nodes,
+                client=client,
+                network_service=network_service,
+                node_ids=allocation.node_ids,
             )
+    async for _ in tracking.execute():
+        pass
+
+    for location_shortname, location_services in services_by_location.items():
+        log.info(f"- {location_shortname}: {len(location_services)} services")
+    log.info(
+        f"Generated {len(network_services)} services in "
+        f"{time.perf_counter() - started_at:.2f}s, {noop_services} already had "
+        f"their resources, {failed_services} failed (lookup cache: {LOOKUP_CACHE})"
+    )
@@ -1,28 +1,218 @@
 #!/usr/bin/env python3
+import asyncio
 import logging
+import time
 
-from typing import List, Set
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 from infrahub_sdk import InfrahubClient
+from infrahub_sdk.batch import InfrahubBatch
 from infrahub_sdk.node import InfrahubNode
 
+from location_index import LocationIndex
+from security_rule_matcher import RENDERED_RULE_KIND, RENDERED_RULE_MANY_RELATIONSHIPS
+
+
+# Continent > Country > Region > Metro > Building > Floor > Suite > Rack
+LOCATION_MAX_DEPTH = 8
+
+WRITE_CHUNK_SIZE = 100
+
+
+class PolicyRuleIndex:
+    """Rules of a policy grouped by (source zone, destination zone).
+
+    Rules keep their position in the policy so a device gets them back in the
+    policy order, whichever zone pairs it matches.
+    """
+
+    def __init__(self, rules: List[InfrahubNode]):
+        self._by_zone_pair: Dict[Tuple[str, str], List[Tuple[int, InfrahubNode]]] = (
+            defaultdict(list)
+        )
+        for position, rule in enumerate(rules):
+            self._by_zone_pair[(rule.source_zone.id, rule.destination_zone.id)].append(
+                (position, rule)
+            )
+
+    def rules_for_zones(self, zone_ids: Set[str]) -> List[InfrahubNode]:
+        if len(zone_ids) ** 2 < len(self._by_zone_pair):
+            zone_pairs = [
+                (source, destination) for source in zone_ids for destination in zone_ids
+            ]
+        else:
+            zone_pairs = [
+                (source, destination)
+                for source, destination in self._by_zone_pair
+                if source in zone_ids and destination in zone_ids
+            ]
+
+        matches: List[Tuple[int, InfrahubNode]] = []
+        for zone_pair in zone_pairs:
+            matches.extend(self._by_zone_pair.get(zone_pair, []))
+        matches.sort(key=lambda match: match[0])
+        return [rule for _, rule in matches]
+
+
+class PolicyRenderCache:
+    """Per-run cache shared by every device rendered in the same run.
+
+    Lookups are single-flight: concurrent requests for the same key wait on
+    the same query instead of issuing their own.
+    """
+
+    def __init__(self, client: InfrahubClient):
+        self.client = client
+        self._account: Optional[asyncio.Task] = None
+        self._policies: Dict[str, asyncio.Task] = {}
+        self._policy_rules: Dict[str, asyncio.Task] = {}
+        self._location_policies: Dict[str, asyncio.Task] = {}
+        self._rule_indexes: Dict[str, asyncio.Task] = {}
+
+    async def account(self) -> InfrahubNode:
+        if self._account is None:
+            self._account = asyncio.ensure_future(
+                self.client.get("CoreAccount", name__value="generator")
+            )
+        return await self._account
+
+    async def policy(self, policy_id: str) -> InfrahubNode:
+        if policy_id not in self._policies:
+            self._policies[policy_id] = asyncio.ensure_future(
+                self.client.get(kind="SecurityPolicy", id=policy_id)
+            )
+        return await self._policies[policy_id]
+
+    async def location_policies(
+        self, index: LocationIndex, location_id: str
+    ) -> List[InfrahubNode]:
+        """Effective policies of a location, from the location itself up to the root.
+
+        The chain of a location is its own policy followed by the memoized chain
+        of its parent, so every location is resolved once per run.
+        """
+        if location_id not in self._location_policies:
+            self._location_policies[location_id] = asyncio.ensure_future(
+                self._resolve_location_policies(index, location_id)
+            )
+        return list(await self._location_policies[location_id])
+
+    async def _resolve_location_policies(
+        self, index: LocationIndex, location_id: str
+    ) -> Tuple[InfrahubNode, ...]:
+        location = index.get(location_id)
+        policies: List[InfrahubNode] = []
+        if hasattr(location, "policy") and location.policy.id:
+            policies.append(await self.policy(location.policy.id))
+
+        parent_id = index.parent_id(location)
+        if parent_id and parent_id in index:
+            policies.extend(await self.location_policies(index, parent_id))
+        return tuple(policies)
+
+    async def policy_rules(self, policy_id: str) -> List[InfrahubNode]:
+        if policy_id not in self._policy_rules:
+            self._policy_rules[policy_id] = asyncio.ensure_future(
+                self.client.filters(
+                    "SecurityPolicyRule",
+                    policy__ids=[policy_id],
+                    include=RENDERED_RULE_MANY_RELATIONSHIPS,
+                )
+            )
+        return await self._policy_rules[policy_id]
+
+    async def policy_rule_index(self, policy_id: str) -> PolicyRuleIndex:
+        if policy_id not in self._rule_indexes:
+            self._rule_indexes[policy_id] = asyncio.ensure_future(
+                self._build_policy_rule_index(policy_id)
+            )
+        return await self._rule_indexes[policy_id]
+
+    async def _build_policy_rule_index(self, policy_id: str) -> PolicyRuleIndex:
+        return PolicyRuleIndex(rules=await self.policy_rules(policy_id))
+
 
 async def get_devices_from_location_hierarchy(
-    location: InfrahubNode,
+    client: InfrahubClient,
+    location_id: str,
+    branch: Optional[str] = None,
+    max_depth: int = LOCATION_MAX_DEPTH,
+) -> Tuple[List[InfrahubNode], int]:
+    """Return the devices of a location subtree and the number of queries used.
+
+    The subtree is expanded breadth-first: the devices and children of a whole
+    level come from a single query, then all the devices are fetched at once.
+    """
+    device_ids: Dict[str, None] = {}
+    queries = 0
+
+    seen = {location_id}
+    level_ids = [location_id]
+    for _ in range(max_depth):
+        if not level_ids:
+            break
+        locations = await client.filters(
+            kind="LocationGeneric",
+            ids=level_ids,
+            include=["devices", "children"],
+            branch=branch,
+        )
+        queries += 1
+
+        level_ids = []
+        for level_location in locations:
+            device_ids.update((peer.id, None) for peer in level_location.devices.peers)
+            if hasattr(level_location, "children"):
+                for child in level_location.children.peers:
+                    if child.id not in seen:
+                        seen.add(child.id)
+                        level_ids.append(child.id)
+
+    if not device_ids:
+        return [], queries
+
+    devices = await get_devices(client, list(device_ids), branch=branch)
+    queries += 1
+    return devices, queries
+
+
+async def get_devices_from_location_index(
+    client: InfrahubClient,
+    index: LocationIndex,
+    location_id: str,
+    branch: Optional[str] = None,
+) -> List[InfrahubNode]:
+    device_ids = index.device_ids(location_id)
+    if not device_ids:
+        return []
+    return await get_devices(client, device_ids, branch=branch)
+
+
+async def get_devices(
+    client: InfrahubClient, device_ids: List[str], branch: Optional[str] = None
 ) -> List[InfrahubNode]:
-    devices = []
+    # The fragment loads the fields of the concrete kinds, like the device policy
+    return await client.filters(
+        kind="InfraGenericDevice", ids=device_ids, branch=branch, fragment=True
+    )
+
 
-    await location.devices.fetch()
+async def get_policies_from_location_index(
+    index: LocationIndex, location_id: str, cache: Optional[PolicyRenderCache] = None
+) -> List[InfrahubNode]:
+    if cache:
+        return await cache.location_policies(index, location_id)
 
-    if len(location.devices.peers):
-        devices.extend([rel_node.peer for rel_node in location.devices.peers])
+    policies = []
+    for ancestor_id in reversed(index.path(location_id)):
+        location = index.get(ancestor_id)
+        if location.policy.id:
+            await location.policy.fetch()
+            policies.append(location.policy.peer)
 
-    if hasattr(location, "children"):
-        await location.children.fetch()
-        if len(location.children.peers):
-            for child in location.children.peers:
-                devices.extend(await get_devices_from_location_hierarchy(child.peer))
-    return devices
+    return policies
 
 
 async def get_policies_from_location_hierarchy(
@@ -43,154 +233,289 @@ async def get_policies_from_location_hierarchy(
     return policies
 
 
-async def find_policy_targets(policy: InfrahubNode) -> List[InfrahubNode]:
-    targets = []
+async def find_policy_targets(
+    client: InfrahubClient,
+    log: logging.Logger,
+    policy: InfrahubNode,
+    index: Optional[LocationIndex] = None,
+    branch: Optional[str] = None,
+) -> List[InfrahubNode]:
+    targets: Dict[str, InfrahubNode] = {}
 
     if policy.device_target.initialized:
         await policy.device_target.fetch()
-        targets.append(policy.device_target.peer)
+        targets[policy.device_target.id] = policy.device_target.peer
 
     if policy.location_target.initialized:
-        await policy.location_target.fetch()
-        targets.extend(
-            await get_devices_from_location_hierarchy(policy.location_target.peer)
+        location_id = policy.location_target.id
+        if index and location_id in index:
+            devices = await get_devices_from_location_index(
+                client, index, location_id, branch=branch
+            )
+            queries = 1 if devices else 0
+        else:
+            # A location missing from the index is newer than the index
+            devices, queries = await get_devices_from_location_hierarchy(
+                client, location_id, branch=branch
+            )
+        log.info(
+            f"Found {len(devices)} devices under location {location_id} in {queries} queries"
         )
+        for device in devices:
+            targets.setdefault(device.id, device)
 
-    return targets
+    return list(targets.values())
 
 
-async def get_device_security_zones(device: InfrahubNode) -> Set[InfrahubNode]:
-    await device.interfaces.fetch()
-    zones = set()
-
-    for interface in device.interfaces.peers:
-        if hasattr(interface.peer, "security_zone"):
-            await interface.peer.security_zone.fetch()
-            if interface.peer.security_zone:
-                zones.add(interface.peer.security_zone.peer)
-    return zones
-
+async def get_device_security_zone_ids(
+    client: InfrahubClient, device: InfrahubNode
+) -> Set[str]:
+    interfaces = await client.filters(
+        kind="SecurityFirewallInterface", device__ids=[device.id]
+    )
+    return {
+        interface.security_zone.id
+        for interface in interfaces
+        if interface.security_zone.id
+    }
 
-async def find_device_policies(device: InfrahubNode) -> List[InfrahubNode]:
-    await device.location.fetch()
 
+async def find_device_policies(
+    device: InfrahubNode,
+    index: Optional[LocationIndex] = None,
+    cache: Optional[PolicyRenderCache] = None,
+) -> List[InfrahubNode]:
+    device_policy = None
     if device.policy.initialized:
-        await device.policy.fetch()
-    policies = await get_policies_from_location_hierarchy(device.location.peer)
-    if device.policy.initialized and device.policy.peer:
-        policies.insert(0, device.policy.peer)
+        if cache:
+            device_policy = await cache.policy(device.policy.id)
+        else:
+            await device.policy.fetch()
+            device_policy = device.policy.peer
+
+    if index and device.location.id in index:
+        policies = await get_policies_from_location_index(
+            index, device.location.id, cache=cache
+        )
+    else:
+        await device.location.fetch()
+        policies = await get_policies_from_location_hierarchy(device.location.peer)
+    if device_policy:
+        policies.insert(0, device_policy)
     return policies[::-1]
 
 
-async def render_policy_for_device(
-    client: InfrahubClient, device: InfrahubNode, policies: List[InfrahubNode]
-) -> None:
-    index = 0
-    rendered_rules = []
+@dataclass
+class RenderedRulesDiff:
+    created: int = 0
+    updated: int = 0
+    deleted: int = 0
+    unchanged: int = 0
 
-    account = await client.get("CoreAccount", name__value="generator")
-    await device.rules.fetch()
-    rules = [rule.peer for rule in device.rules.peers]
+    @property
+    def changes(self) -> int:
+        return self.created + self.updated + self.deleted
 
-    for rule in rules:
-        device.rules.remove(rule)
-    await device.save()
+    def __str__(self) -> str:
+        return (
+            f"{self.created} created, {self.updated} updated, "
+            f"{self.deleted} deleted, {self.unchanged} unchanged"
+        )
 
-    for rule in rules:
-        await client.delete(kind="SecurityRenderedPolicyRule", id=rule.id)
 
-    security_zones = await get_device_security_zones(device)
+def rendered_rule_spec(index: int, rule: InfrahubNode) -> Dict[str, Any]:
+    """Describe the rendered rule of a policy rule with plain values and peer IDs."""
+    spec: Dict[str, Any] = {
+        "index": index,
+        "name": rule.name.value,
+        "action": rule.action.value,
+        "log": rule.log.value,
+        "source_zone": rule.source_zone.id,
+        "destination_zone": rule.destination_zone.id,
+        "source_policy": rule.policy.id,
+    }
+    for rel_name in RENDERED_RULE_MANY_RELATIONSHIPS:
+        spec[rel_name] = getattr(rule, rel_name).peer_ids
+    return spec
+
+
+def existing_rendered_rule_spec(rendered_rule: InfrahubNode) -> Dict[str, Any]:
+    spec: Dict[str, Any] = {
+        "index": rendered_rule.index.value,
+        "name": rendered_rule.name.value,
+        "action": rendered_rule.action.value,
+        "log": rendered_rule.log.value,
+        "source_zone": rendered_rule.source_zone.id,
+        "destination_zone": rendered_rule.destination_zone.id,
+        "source_policy": rendered_rule.source_policy.id,
+    }
+    for rel_name in RENDERED_RULE_MANY_RELATIONSHIPS:
+        spec[rel_name] = getattr(rendered_rule, rel_name).peer_ids
+    return spec
+
+
+def rendered_rule_fingerprint(spec: Dict[str, Any]) -> Tuple:
+    return (
+        spec["index"],
+        spec["name"],
+        spec["action"],
+        bool(spec["log"]),
+        spec["source_zone"],
+        spec["destination_zone"],
+        spec["source_policy"],
+        *(
+            tuple(sorted(spec[rel_name]))
+            for rel_name in RENDERED_RULE_MANY_RELATIONSHIPS
+        ),
+    )
 
-    # async with client.start_tracking(identifier=Path(__file__).stem, params={"device": device.name.value}, delete_unused_nodes=True) as client:
-    for policy in policies:
-        rules = await client.filters(
-            "SecurityPolicyRule",
-            policy__ids=[policy.id],
-            populate_store=True,
-            prefetch_relationships=True,
+
+def rendered_rule_data(spec: Dict[str, Any], account: InfrahubNode) -> Dict[str, Any]:
+    """Build the create/upsert payload of a rendered rule, protected by the generator account."""
+    data: Dict[str, Any] = {}
+    for attr_name in ("index", "name", "action", "log"):
+        data[attr_name] = {
+            "value": spec[attr_name],
+            "is_protected": True,
+            "owner": account.id,
+        }
+    for rel_name in ("source_zone", "destination_zone", "source_policy"):
+        data[rel_name] = {
+            "id": spec[rel_name],
+            "is_protected": True,
+            "owner": account.id,
+        }
+    for rel_name in RENDERED_RULE_MANY_RELATIONSHIPS:
+        data[rel_name] = [
+            {"id": peer_id, "is_protected": True, "owner": account.id}
+            for peer_id in spec[rel_name]
+        ]
+    return data
+
+
+async def write_in_chunks(
+    client: InfrahubClient,
+    nodes: List[InfrahubNode],
+    delete: bool = False,
+    chunk_size: int = WRITE_CHUNK_SIZE,
+) -> None:
+    """Upsert or delete nodes through client batches of at most `chunk_size` mutations."""
+    for start in range(0, len(nodes), chunk_size):
+        batch = await client.create_batch()
+        for node in nodes[start : start + chunk_size]:
+            if delete:
+                batch.add(task=node.delete, node=node)
+            else:
+                batch.add(task=node.save, node=node, allow_upsert=True)
+        async for _ in batch.execute():
+            pass
+
+
+async def render_policy_for_device(
+    client: InfrahubClient,
+    device: InfrahubNode,
+    policies: List[InfrahubNode],
+    cache: Optional[PolicyRenderCache] = None,
+) -> RenderedRulesDiff:
+    diff = RenderedRulesDiff()
+    cache = cache or PolicyRenderCache(client)
+    account = await cache.account()
+
+    # Only the IDs of the current rules are needed, fetching the peers one by one isn't
+    if not device.rules.initialized:
+        device = await client.get(
+            kind=device._schema.kind, id=device.id, include=["rules"]
+        )
+    existing_rules = []
+    if device.rules.peer_ids:
+        existing_rules = await client.filters(
+            kind=RENDERED_RULE_KIND,
+            ids=device.rules.peer_ids,
+            include=RENDERED_RULE_MANY_RELATIONSHIPS,
         )
 
-        for rule in rules:
-            if (
-                rule.source_zone.peer in security_zones
-                and rule.destination_zone.peer in security_zones
-            ):
-                rendered_rule = await client.create(
-                    "SecurityRenderedPolicyRule",
-                    index={"value": index, "is_protected": True, "owner": account.id},
-                    action={
-                        "value": rule.action.value,
-                        "is_protected": True,
-                        "owner": account.id,
-                    },
-                    log={
-                        "value": rule.log.value,
-                        "is_protected": True,
-                        "owner": account.id,
-                    },
-                    name={
-                        "value": rule.name.value,
-                        "is_protected": True,
-                        "owner": account.id,
-                    },
-                    source_zone={
-                        "id": rule.source_zone.peer.id,
-                        "is_protected": True,
-                        "owner": account.id,
-                    },
-                    destination_zone={
-                        "id": rule.destination_zone.peer.id,
-                        "is_protected": True,
-                        "owner": account.id,
-                    },
-                    source_policy={
-                        "id": rule.policy.peer.id,
-                        "is_protected": True,
-                        "owner": account.id,
-                    },
-                    source_address=[
-                        {"id": s.peer.id, "is_protected": True, "owner": account.id}
-                        for s in rule.source_address.peers
-                    ],
-                    source_groups=[
-                        {"id": s.peer.id, "is_protected": True, "owner": account.id}
-                        for s in rule.source_groups.peers
-                    ],
-                    source_services=[
-                        {"id": s.peer.id, "is_protected": True, "owner": account.id}
-                        for s in rule.source_services.peers
-                    ],
-                    source_service_groups=[
-                        {"id": s.peer.id, "is_protected": True, "owner": account.id}
-                        for s in rule.source_service_groups.peers
-                    ],
-                    destination_address=[
-                        {"id": d.peer.id, "is_protected": True, "owner": account.id}
-                        for d in rule.destination_address.peers
-                    ],
-                    destination_groups=[
-                        {"id": d.peer.id, "is_protected": True, "owner": account.id}
-                        for d in rule.destination_groups.peers
-                    ],
-                    destination_services=[
-                        {"id": d.peer.id, "is_protected": True, "owner": account.id}
-                        for d in rule.destination_services.peers
-                    ],
-                    destination_service_groups=[
-                        {"id": d.peer.id, "is_protected": True, "owner": account.id}
-                        for d in rule.destination_service_groups.peers
-                    ],
+    zone_ids = await get_device_security_zone_ids(client, device)
+
+    index = 0
+    desired_specs = []
+    for policy in policies:
+        rule_index = await cache.policy_rule_index(policy.id)
+
+        for rule in rule_index.rules_for_zones(zone_ids):
+            desired_specs.append(rendered_rule_spec(index=index, rule=rule))
+            index += 1
+
+    # Rendered rules are matched on their index, the fingerprint tells if they changed
+    existing_by_index: Dict[int, InfrahubNode] = {}
+    stale_rules = []
+    for rendered_rule in existing_rules:
+        if rendered_rule.index.value in existing_by_index:
+            stale_rules.append(rendered_rule)
+        else:
+            existing_by_index[rendered_rule.index.value] = rendered_rule
+
+    created_rules = []
+    updated_rules = []
+    for spec in desired_specs:
+        existing_rule = existing_by_index.pop(spec["index"], None)
+        if existing_rule is None:
+            created_rules.append(
+                await client.create(
+                    RENDERED_RULE_KIND, data=rendered_rule_data(spec, account)
+                )
+            )
+        elif rendered_rule_fingerprint(
+            existing_rendered_rule_spec(existing_rule)
+        ) == rendered_rule_fingerprint(spec):
+            diff.unchanged += 1
+        else:
+            updated_rules.append(
+                await client.create(
+                    RENDERED_RULE_KIND,
+                    data={"id": existing_rule.id, **rendered_rule_data(spec, account)},
                 )
-                await rendered_rule.save(allow_upsert=True)
-                rendered_rules.append(rendered_rule)
-                index += 1
-
-    await device.rules.fetch()
-    device.rules.extend(
-        {"id": rule.id, "is_protected": True, "owner": account.id}
-        for rule in rendered_rules
+            )
+    stale_rules.extend(existing_by_index.values())
+
+    # Single write phase: rules first, then the device relationship, then deletions
+    await write_in_chunks(client, created_rules + updated_rules)
+    diff.created = len(created_rules)
+    diff.updated = len(updated_rules)
+
+    if created_rules or stale_rules:
+        for rule in stale_rules:
+            device.rules.remove(rule.id)
+        device.rules.extend(
+            {"id": rule.id, "is_protected": True, "owner": account.id}
+            for rule in created_rules
+        )
+        await device.save()
+
+    await write_in_chunks(client, stale_rules, delete=True)
+    diff.deleted = len(stale_rules)
+
+    return diff
+
+
+@dataclass
+class DeviceRenderResult:
+    device: InfrahubNode
+    diff: RenderedRulesDiff
+    elapsed: float
+
+
+async def render_device(
+    client: InfrahubClient,
+    device: InfrahubNode,
+    index: Optional[LocationIndex],
+    cache: PolicyRenderCache,
+) -> DeviceRenderResult:
+    started_at = time.perf_counter()
+    policies = await find_device_policies(device, index=index, cache=cache)
+    diff = await render_policy_for_device(client, device, policies, cache=cache)
+    return DeviceRenderResult(
+        device=device, diff=diff, elapsed=time.perf_counter() - started_at
     )
-    await device.save()
 
 
 async def run(
@@ -202,8 +527,43 @@ async def run(
     policy_name = kwargs["policy"]
 
     policy = await client.get(kind="SecurityPolicy", name__value=policy_name)
-    targets = await find_policy_targets(policy)
 
+    # One query for the whole location tree, reused by every lookup of this run
+    index = await LocationIndex.from_client(client=client, branch=branch)
+    log.info(f"Indexed {len(index)} locations")
+
+    targets = await find_policy_targets(client, log, policy, index=index, branch=branch)
+
+    # Devices are rendered concurrently. The pipeline gets its own limit, the
+    # client one is left to the rule writes issued by every device.
+    cache = PolicyRenderCache(client)
+    batch = InfrahubBatch(
+        max_concurrent_execution=int(
+            kwargs.get("concurrency", client.max_concurrent_execution)
+        )
+    )
     for target in targets:
-        policies = await find_device_policies(target)
-        await render_policy_for_device(client, target, policies)
+        batch.add(
+            task=render_device,
+            client=client,
+            device=target,
+            index=index,
+            cache=cache,
+            node=target,
+        )
+
+    started_at = time.perf_counter()
+    results: List[DeviceRenderResult] = []
+    async for _, result in batch.execute():
+        results.append(result)
+        log.info(
+            f"- Rendered {result.device.name.value} in {result.elapsed:.2f}s: {result.diff}"
+        )
+
+    if results:
+        slowest = max(results, key=lambda result: result.elapsed)
+        log.info(
+            f"Rendered {len(results)} devices in {time.perf_counter() - started_at:.2f}s "
+            f"(slowest {slowest.device.name.value} in {slowest.elapsed:.2f}s, "
+            f"sum {sum(result.elapsed for result in results):.2f}s)"
+        )
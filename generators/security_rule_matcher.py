@@ -0,0 +1,898 @@
+from __future__ import annotations
+
+import ipaddress
+from bisect import bisect_right
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from infrahub_sdk import InfrahubClient
+from infrahub_sdk.node import InfrahubNode
+
+# ---------------------------------------------------------------
+# Compiled first-match engine over the rendered rules of a firewall.
+#
+# Every dimension of a rule (source, destination, service, source service)
+# is turned into integer intervals:
+#   - addresses live on a single axis, IPv4 being mapped into ::ffff:0:0/96
+#   - services live on a (protocol << 16 | port) axis
+#
+# Rules are compiled in blocks of `block_size`. Within a block each dimension
+# is a sorted list of boundaries with the bitset of the rules covering every
+# segment, so a lookup is one bisect per dimension and a few integer ANDs.
+# Blocks are evaluated in rule order and the search stops at the first block
+# holding a match, which keeps the bitsets small and most lookups short.
+# ---------------------------------------------------------------
+
+Interval = Tuple[int, int]
+
+DEFAULT_BLOCK_SIZE = 2048
+COVER_CHUNK_SIZE = 32
+
+IPV4_MAPPED_OFFSET = 0xFFFF << 32
+PORT_MAX = 0xFFFF
+# Protocols a port without protocol applies to (TCP, UDP, SCTP)
+PORT_PROTOCOLS = (6, 17, 132)
+
+RENDERED_RULE_KIND = "SecurityRenderedPolicyRule"
+RENDERED_RULE_MANY_RELATIONSHIPS = [
+    "source_address",
+    "source_groups",
+    "source_services",
+    "source_service_groups",
+    "destination_address",
+    "destination_groups",
+    "destination_services",
+    "destination_service_groups",
+]
+
+
+def address_key(address: str) -> int:
+    """Position of an IPv4/IPv6 address on the address axis."""
+    ip = ipaddress.ip_address(address)
+    if ip.version == 4:
+        return IPV4_MAPPED_OFFSET + int(ip)
+    return int(ip)
+
+
+def network_interval(network: str) -> Interval:
+    """Interval covered by a prefix, an address with or without mask length."""
+    net = ipaddress.ip_network(network, strict=False)
+    offset = IPV4_MAPPED_OFFSET if net.version == 4 else 0
+    return (
+        offset + int(net.network_address),
+        offset + int(net.broadcast_address),
+    )
+
+
+def host_interval(address: str) -> Interval:
+    """Interval of a single host, the mask length of an interface notation is ignored."""
+    key = address_key(str(ipaddress.ip_interface(address).ip))
+    return key, key
+
+
+def range_interval(start: str, end: str) -> Interval:
+    return host_interval(start)[0], host_interval(end)[0]
+
+
+def service_key(protocol: int, port: Optional[int] = None) -> int:
+    """Position of a (protocol, port) pair on the service axis, portless flows use port 0."""
+    return (protocol << 16) | (port or 0)
+
+
+def service_intervals(
+    protocol: Optional[int], start: Optional[int] = None, end: Optional[int] = None
+) -> List[Interval]:
+    """Intervals of a service, all ports when no port is given."""
+    if start is None:
+        start, end = 0, PORT_MAX
+    elif end is None:
+        end = start
+    protocols = PORT_PROTOCOLS if protocol is None else (protocol,)
+    return [(service_key(proto, start), service_key(proto, end)) for proto in protocols]
+
+
+def merge_intervals(intervals: Iterable[Interval]) -> List[Interval]:
+    """Sort intervals and merge the overlapping or adjacent ones."""
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+@dataclass
+class MatchRule:
+    """A rendered rule reduced to intervals.
+
+    A dimension set to None matches anything, an empty list matches nothing
+    (e.g. a rule only referencing FQDNs has no address interval to match).
+    """
+
+    index: int
+    name: str
+    action: str
+    log: bool = False
+    source_zone: Optional[str] = None
+    destination_zone: Optional[str] = None
+    source: Optional[List[Interval]] = None
+    destination: Optional[List[Interval]] = None
+    services: Optional[List[Interval]] = None
+    source_services: Optional[List[Interval]] = None
+
+
+class Flow(NamedTuple):
+    source: str
+    destination: str
+    protocol: int
+    port: Optional[int] = None
+    source_port: Optional[int] = None
+    source_zone: Optional[str] = None
+    destination_zone: Optional[str] = None
+
+
+class IntervalMasks:
+    """Sorted segment boundaries of one dimension with the bitset of the rules covering each segment."""
+
+    __slots__ = ("boundaries", "masks", "any_mask", "_chunk_masks")
+
+    def __init__(self, rule_intervals: Sequence[Optional[List[Interval]]]):
+        self.any_mask = 0
+        events: Dict[int, int] = defaultdict(int)
+        for bit, intervals in enumerate(rule_intervals):
+            if intervals is None:
+                self.any_mask |= 1 << bit
+                continue
+            # Intervals of a rule are merged first so toggling its bit is exact
+            for start, end in merge_intervals(intervals):
+                events[start] ^= 1 << bit
+                events[end + 1] ^= 1 << bit
+
+        self.boundaries: List[int] = []
+        self.masks: List[int] = []
+        interned: Dict[int, int] = {}
+        current = 0
+        for point in sorted(events):
+            current ^= events[point]
+            self.boundaries.append(point)
+            self.masks.append(interned.setdefault(current, current))
+        self._chunk_masks: Optional[List[int]] = None
+
+    def mask(self, value: int) -> int:
+        position = bisect_right(self.boundaries, value) - 1
+        if position < 0:
+            return self.any_mask
+        return self.any_mask | self.masks[position]
+
+    def masks_for(self, values: Iterable[int]) -> Dict[int, int]:
+        """Masks of many values in one sweep over the boundaries."""
+        result = {}
+        position = -1
+        boundaries = self.boundaries
+        for value in sorted(set(values)):
+            while position + 1 < len(boundaries) and boundaries[position + 1] <= value:
+                position += 1
+            result[value] = self.any_mask | (
+                self.masks[position] if position >= 0 else 0
+            )
+        return result
+
+    def covering_mask(self, start: int, end: int) -> int:
+        """Bitset of the rules covering every value of [start, end].
+
+        The masks of the segments spanned by the interval are ANDed, whole
+        chunks of COVER_CHUNK_SIZE segments at once.
+        """
+        first = bisect_right(self.boundaries, start) - 1
+        last = bisect_right(self.boundaries, end) - 1
+        if first < 0:
+            return self.any_mask
+        if self._chunk_masks is None:
+            self._chunk_masks = []
+            for chunk_start in range(0, len(self.masks), COVER_CHUNK_SIZE):
+                chunk_mask = -1
+                for mask in self.masks[chunk_start : chunk_start + COVER_CHUNK_SIZE]:
+                    chunk_mask &= mask
+                self._chunk_masks.append(chunk_mask)
+
+        mask = -1
+        position = first
+        while position <= last and mask:
+            if (
+                position % COVER_CHUNK_SIZE == 0
+                and position + COVER_CHUNK_SIZE - 1 <= last
+            ):
+                mask &= self._chunk_masks[position // COVER_CHUNK_SIZE]
+                position += COVER_CHUNK_SIZE
+            else:
+                mask &= self.masks[position]
+                position += 1
+        return self.any_mask | mask
+
+    def rule_covering_mask(self, intervals: Optional[List[Interval]]) -> int:
+        """Bitset of the rules covering all the intervals of a rule."""
+        if intervals is None:
+            return self.any_mask
+        mask = -1
+        for start, end in intervals:
+            mask &= self.covering_mask(start, end)
+            if not mask:
+                break
+        return mask
+
+
+class RuleBlock:
+    def __init__(self, rules: List[MatchRule]):
+        self.rules = rules
+        self.all_mask = (1 << len(rules)) - 1
+        self.source = IntervalMasks([rule.source for rule in rules])
+        self.destination = IntervalMasks([rule.destination for rule in rules])
+        self.services = IntervalMasks([rule.services for rule in rules])
+        self.source_services = IntervalMasks([rule.source_services for rule in rules])
+        # Rules without source service constraint, for flows without source port
+        self.no_source_service_mask = self.source_services.any_mask
+
+        self.source_zones: Dict[Optional[str], int] = defaultdict(int)
+        self.destination_zones: Dict[Optional[str], int] = defaultdict(int)
+        for bit, rule in enumerate(rules):
+            self.source_zones[rule.source_zone] |= 1 << bit
+            self.destination_zones[rule.destination_zone] |= 1 << bit
+
+    def zone_mask(
+        self, source_zone: Optional[str], destination_zone: Optional[str]
+    ) -> int:
+        mask = self.all_mask
+        if source_zone is not None:
+            mask &= self.source_zones.get(source_zone, 0) | self.source_zones.get(
+                None, 0
+            )
+        if destination_zone is not None:
+            mask &= self.destination_zones.get(destination_zone, 0) | (
+                self.destination_zones.get(None, 0)
+            )
+        return mask
+
+    def zone_covering_mask(self, rule: MatchRule) -> int:
+        """Bitset of the rules whose zones include the zones of a rule, a zone set to None meaning any."""
+        mask = self.source_zones.get(None, 0) & self.all_mask
+        if rule.source_zone is not None:
+            mask |= self.source_zones.get(rule.source_zone, 0)
+        destination_mask = self.destination_zones.get(None, 0)
+        if rule.destination_zone is not None:
+            destination_mask |= self.destination_zones.get(rule.destination_zone, 0)
+        return mask & destination_mask
+
+    def first(self, mask: int) -> Optional[MatchRule]:
+        if not mask:
+            return None
+        return self.rules[(mask & -mask).bit_length() - 1]
+
+
+class RuleMatcher:
+    """First-match lookup of flows against an ordered list of rules."""
+
+    def __init__(
+        self, rules: Iterable[MatchRule], block_size: int = DEFAULT_BLOCK_SIZE
+    ):
+        self.rules = sorted(rules, key=lambda rule: rule.index)
+        self.blocks = [
+            RuleBlock(self.rules[start : start + block_size])
+            for start in range(0, len(self.rules), block_size)
+        ]
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def lookup(
+        self,
+        source: str,
+        destination: str,
+        protocol: int,
+        port: Optional[int] = None,
+        source_port: Optional[int] = None,
+        source_zone: Optional[str] = None,
+        destination_zone: Optional[str] = None,
+    ) -> Optional[MatchRule]:
+        """Return the first rule matching the flow, None if the flow hits the implicit deny."""
+        source_key = address_key(source)
+        destination_key = address_key(destination)
+        key = service_key(protocol, port)
+        for block in self.blocks:
+            mask = block.zone_mask(source_zone, destination_zone)
+            mask &= block.source.mask(source_key)
+            if not mask:
+                continue
+            mask &= block.destination.mask(destination_key)
+            if not mask:
+                continue
+            mask &= block.services.mask(key)
+            if source_port is None:
+                mask &= block.no_source_service_mask
+            elif mask:
+                mask &= block.source_services.mask(service_key(protocol, source_port))
+            if mask:
+                return block.first(mask)
+        return None
+
+    def lookup_many(self, flows: Iterable[Flow]) -> List[Optional[MatchRule]]:
+        """Evaluate many flows at once.
+
+        Identical flows are evaluated once and each block resolves the masks of
+        all distinct values of a dimension in a single sweep, so the cost grows
+        with the number of distinct addresses and services rather than flows.
+        """
+        keys = [self._flow_key(flow) for flow in flows]
+        pending: Dict[Tuple, Optional[MatchRule]] = dict.fromkeys(keys)
+
+        unresolved = list(pending)
+        for block in self.blocks:
+            if not unresolved:
+                break
+            sources = block.source.masks_for(key[0] for key in unresolved)
+            destinations = block.destination.masks_for(key[1] for key in unresolved)
+            services = block.services.masks_for(key[2] for key in unresolved)
+            source_services = block.source_services.masks_for(
+                key[3] for key in unresolved if key[3] is not None
+            )
+            zones: Dict[Tuple[Optional[str], Optional[str]], int] = {}
+
+            remaining = []
+            for key in unresolved:
+                zone_pair = (key[4], key[5])
+                if zone_pair not in zones:
+                    zones[zone_pair] = block.zone_mask(*zone_pair)
+                mask = (
+                    zones[zone_pair]
+                    & sources[key[0]]
+                    & destinations[key[1]]
+                    & services[key[2]]
+                )
+                if key[3] is None:
+                    mask &= block.no_source_service_mask
+                else:
+                    mask &= source_services[key[3]]
+                if mask:
+                    pending[key] = block.first(mask)
+                else:
+                    remaining.append(key)
+            unresolved = remaining
+
+        return [pending[key] for key in keys]
+
+    @staticmethod
+    def _flow_key(flow: Flow) -> Tuple:
+        return (
+            address_key(flow.source),
+            address_key(flow.destination),
+            service_key(flow.protocol, flow.port),
+            None
+            if flow.source_port is None
+            else service_key(flow.protocol, flow.source_port),
+            flow.source_zone,
+            flow.destination_zone,
+        )
+
+
+class GroupFlattener:
+    """Flatten hierarchical groups into merged intervals, memoized per group ID.
+
+    A group covers its own members and the members of all its descendants, so
+    a group reused by many rules and devices is only expanded once per run.
+    """
+
+    def __init__(self, objects: Dict[str, List[Interval]]):
+        self.objects = objects
+        self.members: Dict[str, List[str]] = {}
+        self.children: Dict[str, List[str]] = {}
+        self.parents: Dict[str, Set[str]] = defaultdict(set)
+        self._flattened: Dict[str, List[Interval]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def add(
+        self, group_id: str, member_ids: List[str], child_ids: Iterable[str] = ()
+    ) -> None:
+        child_ids = list(child_ids)
+        if (
+            self.members.get(group_id) == member_ids
+            and self.children.get(group_id) == child_ids
+        ):
+            return
+
+        for child_id in self.children.get(group_id, []):
+            self.parents[child_id].discard(group_id)
+        for child_id in child_ids:
+            self.parents[child_id].add(group_id)
+        self.members[group_id] = member_ids
+        self.children[group_id] = child_ids
+        self._invalidate(group_id)
+
+    def _invalidate(self, group_id: str) -> None:
+        """Forget the memoized group and every ancestor including it."""
+        stack = [group_id]
+        seen = set()
+        while stack:
+            current = stack.pop()
+            if current in seen:
+                continue
+            seen.add(current)
+            self._flattened.pop(current, None)
+            stack.extend(self.parents.get(current, ()))
+
+    def flatten(self, group_id: str, path: Tuple[str, ...] = ()) -> List[Interval]:
+        if group_id in self._flattened:
+            self.hits += 1
+            return self._flattened[group_id]
+        if group_id in path:
+            cycle = path[path.index(group_id) :] + (group_id,)
+            raise ValueError(f"Cycle detected in nested groups: {' -> '.join(cycle)}")
+
+        self.misses += 1
+        intervals: List[Interval] = []
+        for member_id in self.members.get(group_id, []):
+            intervals.extend(self.objects.get(member_id, []))
+        for child_id in self.children.get(group_id, []):
+            intervals.extend(self.flatten(child_id, path + (group_id,)))
+        self._flattened[group_id] = merge_intervals(intervals)
+        return self._flattened[group_id]
+
+
+class SecurityObjectResolver:
+    """Resolve security addresses, services and their groups into intervals.
+
+    Objects are loaded with one query per kind for all the IDs referenced by a
+    set of rules, or from the result of a GraphQL query, then shared by every
+    rule referencing them.
+    """
+
+    def __init__(
+        self, client: Optional[InfrahubClient] = None, branch: Optional[str] = None
+    ):
+        self.client = client
+        self.branch = branch
+        self.addresses: Dict[str, List[Interval]] = {}
+        self.services: Dict[str, List[Interval]] = {}
+        self.address_groups = GroupFlattener(self.addresses)
+        self.service_groups = GroupFlattener(self.services)
+
+    async def _filters(self, kind: str, ids: List[str], **kwargs) -> List[InfrahubNode]:
+        if not ids:
+            return []
+        return await self.client.filters(
+            kind=kind, ids=ids, branch=self.branch, **kwargs
+        )
+
+    async def load(self, rules: List[InfrahubNode]) -> None:
+        address_ids = set()
+        service_ids = set()
+        address_group_ids = set()
+        service_group_ids = set()
+        for rule in rules:
+            for side in ("source", "destination"):
+                address_ids.update(getattr(rule, f"{side}_address").peer_ids)
+                address_group_ids.update(getattr(rule, f"{side}_groups").peer_ids)
+                service_ids.update(getattr(rule, f"{side}_services").peer_ids)
+                service_group_ids.update(
+                    getattr(rule, f"{side}_service_groups").peer_ids
+                )
+
+        address_ids.update(
+            await self._load_groups(
+                "SecurityGenericAddressGroup",
+                "addresses",
+                address_group_ids,
+                self.address_groups,
+            )
+        )
+        service_ids.update(
+            await self._load_groups(
+                "SecurityGenericServiceGroup",
+                "services",
+                service_group_ids,
+                self.service_groups,
+            )
+        )
+
+        await self._load_addresses(list(address_ids - set(self.addresses)))
+        await self._load_services(list(service_ids - set(self.services)))
+
+    async def _load_groups(
+        self,
+        kind: str,
+        members: str,
+        group_ids: Set[str],
+        groups: GroupFlattener,
+    ) -> Set[str]:
+        """Load groups and their descendants, one query per level, and return their member IDs."""
+        member_ids: Set[str] = set()
+        pending = group_ids - set(groups.members)
+        while pending:
+            nodes = await self._filters(
+                kind, list(pending), include=[members, "children"]
+            )
+            for node in nodes:
+                groups.add(
+                    node.id, getattr(node, members).peer_ids, node.children.peer_ids
+                )
+                member_ids.update(getattr(node, members).peer_ids)
+            pending = {
+                child_id for node in nodes for child_id in node.children.peer_ids
+            } - set(groups.members)
+        return member_ids
+
+    async def _load_addresses(self, ids: List[str]) -> None:
+        for node in await self._filters("SecurityPrefix", ids):
+            self.addresses[node.id] = [network_interval(str(node.prefix.value))]
+        for node in await self._filters("SecurityIPAddress", ids):
+            self.addresses[node.id] = [host_interval(str(node.address.value))]
+        for node in await self._filters("SecurityIPRange", ids):
+            self.addresses[node.id] = [
+                range_interval(str(node.start.value), str(node.end.value))
+            ]
+
+        # IPAM backed objects point to an InfraPrefix / InfraIPAddress
+        ipam_prefixes = {
+            node.id: node.ip_prefix.id
+            for node in await self._filters("SecurityIPAMIPPrefix", ids)
+        }
+        ipam_addresses = {
+            node.id: node.ip_address.id
+            for node in await self._filters("SecurityIPAMIPAddress", ids)
+        }
+        prefixes = {
+            node.id: str(node.prefix.value)
+            for node in await self._filters("InfraPrefix", list(ipam_prefixes.values()))
+        }
+        ip_addresses = {
+            node.id: str(node.address.value)
+            for node in await self._filters(
+                "InfraIPAddress", list(ipam_addresses.values())
+            )
+        }
+        for node_id, prefix_id in ipam_prefixes.items():
+            if prefix_id in prefixes:
+                self.addresses[node_id] = [network_interval(prefixes[prefix_id])]
+        for node_id, address_id in ipam_addresses.items():
+            if address_id in ip_addresses:
+                self.addresses[node_id] = [host_interval(ip_addresses[address_id])]
+
+    async def _load_services(self, ids: List[str]) -> None:
+        wanted = set(ids)
+        protocols = {
+            node.id: node.protocol.value
+            for node in await self.client.all("SecurityIPProtocol", branch=self.branch)
+        }
+        for protocol_id, protocol in protocols.items():
+            if protocol_id in wanted:
+                self.services[protocol_id] = (
+                    service_intervals(protocol) if protocol is not None else []
+                )
+        for node in await self._filters("SecurityService", ids):
+            self.services[node.id] = service_intervals(
+                protocols.get(node.ip_protocol.id), node.port.value
+            )
+        for node in await self._filters("SecurityServiceRange", ids):
+            self.services[node.id] = service_intervals(
+                protocols.get(node.ip_protocol.id), node.start.value, node.end.value
+            )
+
+    def _resolve(
+        self,
+        object_ids: List[str],
+        group_ids: List[str],
+        objects: Dict[str, List[Interval]],
+        groups: GroupFlattener,
+    ) -> Optional[List[Interval]]:
+        if not object_ids and not group_ids:
+            return None
+        # A rule referencing a single group shares its flattened intervals
+        if not object_ids and len(group_ids) == 1:
+            return groups.flatten(group_ids[0])
+        intervals: List[Interval] = []
+        for object_id in object_ids:
+            intervals.extend(objects.get(object_id, []))
+        for group_id in group_ids:
+            intervals.extend(groups.flatten(group_id))
+        return merge_intervals(intervals)
+
+    def build_match_rule(
+        self,
+        index: int,
+        name: str,
+        action: str,
+        log: bool,
+        source_zone: Optional[str],
+        destination_zone: Optional[str],
+        peer_ids: Dict[str, List[str]],
+    ) -> MatchRule:
+        """Build a match rule from the peer IDs of its many relationships."""
+        return MatchRule(
+            index=index,
+            name=name,
+            action=action,
+            log=bool(log),
+            source_zone=source_zone,
+            destination_zone=destination_zone,
+            source=self._resolve(
+                peer_ids["source_address"],
+                peer_ids["source_groups"],
+                self.addresses,
+                self.address_groups,
+            ),
+            destination=self._resolve(
+                peer_ids["destination_address"],
+                peer_ids["destination_groups"],
+                self.addresses,
+                self.address_groups,
+            ),
+            services=self._resolve(
+                peer_ids["destination_services"],
+                peer_ids["destination_service_groups"],
+                self.services,
+                self.service_groups,
+            ),
+            source_services=self._resolve(
+                peer_ids["source_services"],
+                peer_ids["source_service_groups"],
+                self.services,
+                self.service_groups,
+            ),
+        )
+
+    def match_rule(self, rule: InfrahubNode, zone_names: Dict[str, str]) -> MatchRule:
+        return self.build_match_rule(
+            index=rule.index.value,
+            name=rule.name.value,
+            action=rule.action.value,
+            log=rule.log.value,
+            source_zone=zone_names.get(rule.source_zone.id, rule.source_zone.id),
+            destination_zone=zone_names.get(
+                rule.destination_zone.id, rule.destination_zone.id
+            ),
+            peer_ids={
+                rel_name: getattr(rule, rel_name).peer_ids
+                for rel_name in RENDERED_RULE_MANY_RELATIONSHIPS
+            },
+        )
+
+    # GraphQL query results, as received by checks and transforms
+
+    @staticmethod
+    def _edge_ids(data: Dict) -> List[str]:
+        return [edge["node"]["id"] for edge in data["edges"] if edge["node"]]
+
+    def load_graphql(self, data: Dict) -> None:
+        """Load the objects listed by a query in the format of `check_security_policy_shadowing`."""
+        protocols = {
+            edge["node"]["id"]: edge["node"]["protocol"]["value"]
+            for edge in data["SecurityIPProtocol"]["edges"]
+        }
+        for edge in data["SecurityGenericAddress"]["edges"]:
+            node = edge["node"]
+            if node["__typename"] == "SecurityPrefix":
+                self.addresses[node["id"]] = [network_interval(node["prefix"]["value"])]
+            elif node["__typename"] == "SecurityIPAddress":
+                self.addresses[node["id"]] = [host_interval(node["address"]["value"])]
+            elif node["__typename"] == "SecurityIPRange":
+                self.addresses[node["id"]] = [
+                    range_interval(node["start"]["value"], node["end"]["value"])
+                ]
+            elif (
+                node["__typename"] == "SecurityIPAMIPPrefix"
+                and node["ip_prefix"]["node"]
+            ):
+                self.addresses[node["id"]] = [
+                    network_interval(node["ip_prefix"]["node"]["prefix"]["value"])
+                ]
+            elif (
+                node["__typename"] == "SecurityIPAMIPAddress"
+                and node["ip_address"]["node"]
+            ):
+                self.addresses[node["id"]] = [
+                    host_interval(node["ip_address"]["node"]["address"]["value"])
+                ]
+        for edge in data["SecurityGenericService"]["edges"]:
+            node = edge["node"]
+            if node["__typename"] == "SecurityIPProtocol":
+                protocol = node["protocol"]["value"]
+                self.services[node["id"]] = (
+                    service_intervals(protocol) if protocol is not None else []
+                )
+                continue
+            protocol_node = node.get("ip_protocol", {}).get("node")
+            protocol = protocols.get(protocol_node["id"]) if protocol_node else None
+            if node["__typename"] == "SecurityService":
+                self.services[node["id"]] = service_intervals(
+                    protocol, node["port"]["value"]
+                )
+            elif node["__typename"] == "SecurityServiceRange":
+                self.services[node["id"]] = service_intervals(
+                    protocol, node["start"]["value"], node["end"]["value"]
+                )
+        for edge in data["SecurityGenericAddressGroup"]["edges"]:
+            self.address_groups.add(
+                edge["node"]["id"],
+                self._edge_ids(edge["node"]["addresses"]),
+                self._edge_ids(edge["node"]["children"]),
+            )
+        for edge in data["SecurityGenericServiceGroup"]["edges"]:
+            self.service_groups.add(
+                edge["node"]["id"],
+                self._edge_ids(edge["node"]["services"]),
+                self._edge_ids(edge["node"]["children"]),
+            )
+
+    def match_rule_from_graphql(self, rule: Dict) -> MatchRule:
+        return self.build_match_rule(
+            index=rule["index"]["value"],
+            name=rule["name"]["value"],
+            action=rule["action"]["value"],
+            log=rule["log"]["value"],
+            source_zone=rule["source_zone"]["node"]["name"]["value"],
+            destination_zone=rule["destination_zone"]["node"]["name"]["value"],
+            peer_ids={
+                rel_name: self._edge_ids(rule[rel_name])
+                for rel_name in RENDERED_RULE_MANY_RELATIONSHIPS
+            },
+        )
+
+
+async def load_device_rules(
+    client: InfrahubClient,
+    device_name: str,
+    branch: Optional[str] = None,
+    kind: str = "SecurityFirewall",
+    resolver: Optional[SecurityObjectResolver] = None,
+) -> List[MatchRule]:
+    """Load the rendered rules of a firewall as match rules, zones referenced by name.
+
+    Pass the same resolver for several devices to load and flatten shared objects once.
+    """
+    device = await client.get(
+        kind=kind, name__value=device_name, branch=branch, include=["rules"]
+    )
+    if not device.rules.peer_ids:
+        return []
+    rules = await client.filters(
+        kind=RENDERED_RULE_KIND,
+        ids=device.rules.peer_ids,
+        branch=branch,
+        include=RENDERED_RULE_MANY_RELATIONSHIPS,
+    )
+    zone_names = {
+        zone.id: zone.name.value
+        for zone in await client.all("SecurityZone", branch=branch)
+    }
+    resolver = resolver or SecurityObjectResolver(client=client, branch=branch)
+    await resolver.load(rules)
+    return [resolver.match_rule(rule, zone_names) for rule in rules]
+
+
+async def compile_device_rules(
+    client: InfrahubClient,
+    device_name: str,
+    branch: Optional[str] = None,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> RuleMatcher:
+    rules = await load_device_rules(
+        client=client, device_name=device_name, branch=branch
+    )
+    return RuleMatcher(rules, block_size=block_size)
+
+
+# ---------------------------------------------------------------
+# Shadowed and redundant rules
+#
+# A rule is dead when an earlier rule covers it in every dimension: no flow
+# can ever reach it. It is reported as shadowed when one of the covering rules
+# has a different action (the intent of the rule is never applied), and as
+# redundant otherwise (removing it changes nothing).
+#
+# Rules are partitioned per zone pair and each partition is compiled into a
+# single block. The rules covering an interval are found by ANDing the masks
+# of the segments it spans, so every rule costs a few bisects and bitset
+# operations instead of a comparison with every earlier rule.
+# Rules only covered by the union of several earlier rules are not reported.
+# ---------------------------------------------------------------
+
+
+@dataclass
+class RuleFinding:
+    kind: str
+    rule: MatchRule
+    covering_rule: MatchRule
+
+    def __str__(self) -> str:
+        return (
+            f"Rule {self.rule.index} '{self.rule.name}' ({self.rule.action}) is {self.kind} "
+            f"by rule {self.covering_rule.index} '{self.covering_rule.name}' ({self.covering_rule.action})"
+        )
+
+
+def _rule_partitions(rules: List[MatchRule]) -> List[Tuple[List[MatchRule], Set[int]]]:
+    """Split rules per zone pair, with the indexes of the rules analyzed in each partition.
+
+    Rules with a zone set to None may cover rules of several zone pairs, they are
+    added to every compatible partition but only analyzed among themselves.
+    """
+    by_zone_pair: Dict[Tuple[str, str], List[MatchRule]] = defaultdict(list)
+    wildcards: List[MatchRule] = []
+    for rule in rules:
+        if rule.source_zone is None or rule.destination_zone is None:
+            wildcards.append(rule)
+        else:
+            by_zone_pair[(rule.source_zone, rule.destination_zone)].append(rule)
+
+    partitions = []
+    for (source_zone, destination_zone), zone_rules in by_zone_pair.items():
+        compatible = [
+            rule
+            for rule in wildcards
+            if rule.source_zone in (None, source_zone)
+            and rule.destination_zone in (None, destination_zone)
+        ]
+        partitions.append(
+            (
+                sorted(zone_rules + compatible, key=lambda rule: rule.index),
+                {rule.index for rule in zone_rules},
+            )
+        )
+    if wildcards:
+        partitions.append(
+            (
+                sorted(wildcards, key=lambda rule: rule.index),
+                {rule.index for rule in wildcards},
+            )
+        )
+    return partitions
+
+
+def find_dead_rules(rules: Iterable[MatchRule]) -> List[RuleFinding]:
+    """Find the rules fully covered by an earlier rule, sorted by rule index."""
+    findings = []
+    for partition, analyzed in _rule_partitions(list(rules)):
+        block = RuleBlock(partition)
+        actions: Dict[str, int] = defaultdict(int)
+        for bit, rule in enumerate(partition):
+            actions[rule.action] |= 1 << bit
+
+        for bit, rule in enumerate(partition):
+            if rule.index not in analyzed or bit == 0:
+                continue
+            dimensions = (
+                (block.source, rule.source),
+                (block.destination, rule.destination),
+                (block.services, rule.services),
+                (block.source_services, rule.source_services),
+            )
+            # A dimension without interval (e.g. FQDN only) can't be compared
+            if any(intervals == [] for _, intervals in dimensions):
+                continue
+
+            mask = ((1 << bit) - 1) & block.zone_covering_mask(rule)
+            for masks, intervals in dimensions:
+                if not mask:
+                    break
+                mask &= masks.rule_covering_mask(intervals)
+            if not mask:
+                continue
+
+            conflicting = mask & ~actions[rule.action]
+            if conflicting:
+                findings.append(
+                    RuleFinding(
+                        kind="shadowed",
+                        rule=rule,
+                        covering_rule=block.first(conflicting),
+                    )
+                )
+            else:
+                findings.append(
+                    RuleFinding(
+                        kind="redundant", rule=rule, covering_rule=block.first(mask)
+                    )
+                )
+    return sorted(findings, key=lambda finding: finding.rule.index)
@@ -0,0 +1,179 @@
+"""Benchmark the OpenConfig interfaces transform against its previous implementation.
+
+Devices are synthetic, shaped like the oc_interfaces query data: a mix of
+layer 2 interfaces and layer 3 interfaces with one or two addresses.
+Throughput is measured for building the payload alone, then with its
+serialization; allocations are counted with tracemalloc.
+
+    python scripts/benchmark_oc_interfaces.py --sizes 10 100 1000 10000
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "transforms"))
+
+from openconfig import device_interfaces, dumps, orjson  # noqa: E402
+
+
+def reference_interfaces(device: dict) -> dict:
+    """The transform as it was before the fast path, kept as the baseline."""
+    response_payload = {}
+    response_payload["openconfig-interfaces:interface"] = []
+
+    for intf in device["interfaces"]["edges"]:
+        intf_name = intf["node"]["name"]["value"]
+
+        intf_config = {
+            "name": intf_name,
+            "config": {"enabled": intf["node"]["enabled"]["value"]},
+        }
+
+        if (
+            intf["node"].get("description", None)
+            and intf["node"]["description"]["value"]
+        ):
+            intf_config["config"]["description"] = intf["node"]["description"]["value"]
+
+        if intf["node"].get("ip_addresses", None):
+            intf_config["subinterfaces"] = {"subinterface": []}
+
+            for idx, ip in enumerate(intf["node"]["ip_addresses"]["edges"]):
+                address, mask = ip["node"]["address"]["value"].split("/")
+                intf_config["subinterfaces"]["subinterface"].append(
+                    {
+                        "index": idx,
+                        "openconfig-if-ip:ipv4": {
+                            "addresses": {
+                                "address": [
+                                    {
+                                        "ip": address,
+                                        "config": {
+                                            "ip": address,
+                                            "prefix-length": mask,
+                                        },
+                                    }
+                                ]
+                            },
+                            "config": {"enabled": True},
+                        },
+                    }
+                )
+
+        response_payload["openconfig-interfaces:interface"].append(intf_config)
+
+    return response_payload
+
+
+def generate_device(size: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    edges = []
+    for index in range(size):
+        node = {
+            "name": {"value": f"Ethernet{index + 1}"},
+            "description": {"value": rng.choice([None, f"to peer{index}"])},
+            "enabled": {"value": rng.random() < 0.9},
+        }
+        if rng.random() < 0.5:
+            node["ip_addresses"] = {
+                "edges": [
+                    {
+                        "node": {
+                            "address": {
+                                "value": f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}/{rng.choice([24, 31])}"
+                            }
+                        }
+                    }
+                    for _ in range(rng.choice([1, 1, 2]))
+                ]
+            }
+        edges.append({"node": node})
+    return {"id": "device", "interfaces": {"edges": edges}}
+
+
+def measure(
+    build: Callable[[dict], dict],
+    serialize: Callable[[dict], str],
+    device: dict,
+    repeat: int,
+) -> Tuple[float, float, int, int]:
+    """Interfaces per second built, then built and serialized, allocated blocks and peak bytes of one run."""
+    size = len(device["interfaces"]["edges"])
+
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        build(device)
+    build_rate = size * repeat / (time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        serialize(build(device))
+    rate = size * repeat / (time.perf_counter() - started_at)
+
+    tracemalloc.start()
+    before = sum(
+        stat.count for stat in tracemalloc.take_snapshot().statistics("filename")
+    )
+    payload = build(device)
+    blocks = (
+        sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+        - before
+    )
+    serialize(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return build_rate, rate, blocks, peak
+
+
+def benchmark(size: int, repeat: int) -> None:
+    device = generate_device(size)
+    if json.dumps(device_interfaces(device)) != json.dumps(
+        reference_interfaces(device)
+    ):
+        raise RuntimeError(
+            f"Fast path disagrees with the reference for {size} interfaces"
+        )
+
+    reference = measure(
+        reference_interfaces,
+        lambda payload: json.dumps(payload, indent=2),
+        device,
+        repeat,
+    )
+    fast = measure(device_interfaces, dumps, device, repeat)
+    for label, (build_rate, rate, blocks, peak) in [
+        ("reference", reference),
+        ("fast", fast),
+    ]:
+        print(
+            f"{size:>6} interfaces | {label:>9} | build {build_rate:>9.0f} intf/s"
+            f" | build+serialize {rate:>9.0f} intf/s | {blocks:>7} blocks"
+            f" | peak {peak / 1024:>8.0f} KiB"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument(
+        "--interfaces",
+        type=int,
+        default=200000,
+        help="interfaces transformed per size, spread over repeated runs",
+    )
+    args = parser.parse_args()
+
+    print(f"Serializer: {'orjson' if orjson else 'json'}")
+    for size in args.sizes:
+        benchmark(size, max(1, args.interfaces // size))
+
+
+if __name__ == "__main__":
+    main()
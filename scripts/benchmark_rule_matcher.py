@@ -0,0 +1,144 @@
+"""Benchmark the compiled rule matcher against a linear first-match scan.
+
+The shadowed/redundant rule analysis is timed on the same rule sets.
+
+Rule sets are synthetic: rules pick their addresses and services from shared
+pools of objects, like real policies referencing address books.
+
+    python scripts/benchmark_rule_matcher.py --sizes 100 1000 10000 100000 --flows 1000000
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "generators"))
+
+from security_rule_matcher import (  # noqa: E402
+    Flow,
+    MatchRule,
+    RuleMatcher,
+    find_dead_rules,
+    network_interval,
+    service_intervals,
+)
+from tests.test_security_rule_matcher import linear_lookup  # noqa: E402
+
+ZONES = ["trust", "untrust", "dmz", "mgmt"]
+PROTOCOLS = [6, 17]
+
+
+def random_network(rng: random.Random) -> str:
+    length = rng.choice([16, 20, 24, 24, 28, 32])
+    address = rng.getrandbits(32) & ~((1 << (32 - length)) - 1)
+    return f"{(address >> 24) & 0xFF}.{(address >> 16) & 0xFF}.{(address >> 8) & 0xFF}.{address & 0xFF}/{length}"
+
+
+def random_intervals(rng: random.Random, pool: List, size: int) -> Optional[List]:
+    if rng.random() < 0.1:
+        return None
+    return [interval for item in rng.sample(pool, size) for interval in item]
+
+
+def generate_rules(size: int, seed: int = 0) -> List[MatchRule]:
+    rng = random.Random(seed)
+    addresses = [
+        [network_interval(random_network(rng))] for _ in range(max(size // 10, 50))
+    ]
+    services = [
+        service_intervals(rng.choice(PROTOCOLS), port, port + rng.choice([0, 0, 0, 9]))
+        for port in rng.sample(range(1, 60000), max(size // 50, 20))
+    ]
+    return [
+        MatchRule(
+            index=index,
+            name=f"rule-{index}",
+            action=rng.choice(["permit", "deny"]),
+            source_zone=rng.choice(ZONES),
+            destination_zone=rng.choice(ZONES),
+            source=random_intervals(rng, addresses, rng.randint(1, 3)),
+            destination=random_intervals(rng, addresses, rng.randint(1, 3)),
+            services=random_intervals(rng, services, rng.randint(1, 2)),
+        )
+        for index in range(size)
+    ]
+
+
+def generate_flows(count: int, seed: int = 1) -> List[Flow]:
+    rng = random.Random(seed)
+    hosts = [".".join(str(rng.randint(0, 255)) for _ in range(4)) for _ in range(2000)]
+    return [
+        Flow(
+            source=rng.choice(hosts),
+            destination=rng.choice(hosts),
+            protocol=rng.choice(PROTOCOLS),
+            port=rng.randint(1, 60000),
+            source_zone=rng.choice(ZONES),
+            destination_zone=rng.choice(ZONES),
+        )
+        for _ in range(count)
+    ]
+
+
+def benchmark(size: int, flows: List[Flow], linear_flows: int) -> None:
+    rules = generate_rules(size)
+
+    started_at = time.perf_counter()
+    matcher = RuleMatcher(rules)
+    compile_time = time.perf_counter() - started_at
+
+    sample = flows[:linear_flows]
+    started_at = time.perf_counter()
+    expected = [linear_lookup(rules, flow) for flow in sample]
+    linear_rate = len(sample) / (time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    found = [matcher.lookup(*flow) for flow in sample]
+    lookup_rate = len(sample) / (time.perf_counter() - started_at)
+    if found != expected:
+        raise RuntimeError(
+            f"Compiled matcher disagrees with the linear scan for {size} rules"
+        )
+
+    started_at = time.perf_counter()
+    matcher.lookup_many(flows)
+    batch_rate = len(flows) / (time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    dead_rules = find_dead_rules(rules)
+    analysis_time = time.perf_counter() - started_at
+
+    print(
+        f"{size:>7} rules | compile {compile_time:7.2f}s | linear {linear_rate:>10.0f} flows/s"
+        f" | lookup {lookup_rate:>10.0f} flows/s | batch {batch_rate:>10.0f} flows/s"
+        f" | {len(dead_rules)} dead rules found in {analysis_time:.2f}s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[100, 1000, 10000, 100000]
+    )
+    parser.add_argument(
+        "--flows", type=int, default=100000, help="flows evaluated in batch mode"
+    )
+    parser.add_argument(
+        "--linear-flows",
+        type=int,
+        default=1000,
+        help="flows compared with the linear scan",
+    )
+    args = parser.parse_args()
+
+    flows = generate_flows(args.flows)
+    for size in args.sizes:
+        benchmark(size, flows, min(args.linear_flows, args.flows))
+
+
+if __name__ == "__main__":
+    main()
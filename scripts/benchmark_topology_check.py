@@ -0,0 +1,212 @@
+"""Benchmark the device topology check on synthetic topologies.
+
+Every topology has a few elements and a group of devices matching them, with
+a share of topologies off by one device or using the wrong device type so the
+check has errors to report. The run time per device should stay flat as the
+number of topologies grows.
+
+    python scripts/benchmark_topology_check.py --topologies 100 1000 10000 --devices 50
+"""
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from checks.check_device_topology import InfrahubCheckDeviceTopology  # noqa: E402
+
+ROLES = ["spine", "leaf", "border_leaf", "firewall"]
+DEVICE_TYPES = ["CCS-720DP-48S-2F", "DCS-7280DR3-24-F", "NCS-5501-SE", "SRX-1500"]
+
+
+def generate_data(topologies: int, devices_per_topology: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    topology_edges = []
+    group_edges = []
+    device_edges = []
+    for index in range(topologies):
+        name = f"topology-{index}"
+        elements = []
+        members = []
+        roles = rng.sample(ROLES, 3)
+        for position, role in enumerate(roles):
+            quantity = devices_per_topology // len(roles) + (position == 0) * (
+                devices_per_topology % len(roles)
+            )
+            device_type = rng.choice(DEVICE_TYPES)
+            elements.append(
+                {
+                    "node": {
+                        "quantity": {"value": quantity},
+                        "device_role": {"value": role},
+                        "device_type": {"node": {"name": {"value": device_type}}},
+                    }
+                }
+            )
+            actual = quantity + rng.choice([0] * 18 + [-1, 1])
+            for device in range(actual):
+                device_id = f"{name}-{role}-{device}"
+                actual_type = (
+                    rng.choice(DEVICE_TYPES) if rng.random() < 0.01 else device_type
+                )
+                device_edges.append(
+                    {
+                        "node": {
+                            "id": device_id,
+                            "role": {"value": role},
+                            "device_type": {"node": {"name": {"value": actual_type}}},
+                        }
+                    }
+                )
+                members.append({"node": {"id": device_id}})
+        topology_edges.append(
+            {"node": {"name": {"value": name}, "elements": {"edges": elements}}}
+        )
+        group_edges.append(
+            {
+                "node": {
+                    "name": {"value": f"{name}_topology"},
+                    "members": {"edges": members},
+                }
+            }
+        )
+    return {
+        "InfraDevice": {"edges": device_edges},
+        "CoreStandardGroup": {"edges": group_edges},
+        "TopologyTopology": {"edges": topology_edges},
+    }
+
+
+def reference_validate(data: dict) -> List[str]:
+    """The check as it was before the single pass rewrite, kept as the baseline."""
+    errors = []
+    topologies = data["TopologyTopology"]["edges"]
+    groups = data["CoreStandardGroup"]["edges"]
+    group_devices = {
+        group["node"]["name"]["value"]: {
+            edge["node"]["id"]
+            for edge in group["node"]["members"]["edges"]
+            if edge["node"]
+        }
+        for group in groups
+    }
+    device_map = {
+        edge["node"]["id"]: edge["node"] for edge in data["InfraDevice"]["edges"]
+    }
+    for topology_edge in topologies:
+        topology_node = topology_edge["node"]
+        topology_name = topology_node["name"]["value"]
+        group_name = f"{topology_name}_topology"
+        if group_name not in group_devices:
+            errors.append(f"No corresponding group found for topology {topology_name}.")
+            continue
+        group_device_ids = group_devices[group_name]
+        expected_role_device_counts = {}
+        for element_edge in topology_node["elements"]["edges"]:
+            element_node = element_edge["node"]
+            role = element_node["device_role"]["value"]
+            device_type = element_node["device_type"]["node"]["name"]["value"]
+            quantity = element_node["quantity"]["value"]
+            if role not in expected_role_device_counts:
+                expected_role_device_counts[role] = {}
+            expected_role_device_counts[role][device_type] = quantity
+        actual_role_device_counts = {}
+        for device_id in group_device_ids:
+            if device_id in device_map:
+                device = device_map[device_id]
+                role = device["role"]["value"]
+                device_type = device["device_type"]["node"]["name"]["value"]
+                if role not in actual_role_device_counts:
+                    actual_role_device_counts[role] = {}
+                actual_role_device_counts[role][device_type] = (
+                    actual_role_device_counts[role].get(device_type, 0) + 1
+                )
+        for role, expected_types in expected_role_device_counts.items():
+            for expected_type, expected_count in expected_types.items():
+                actual_count = actual_role_device_counts.get(role, {}).get(
+                    expected_type, 0
+                )
+                unexpected_types = [
+                    actual_type
+                    for actual_type in actual_role_device_counts.get(role, {})
+                    if actual_type != expected_type
+                ]
+                if expected_count % 2 != 0:
+                    errors.append(
+                        f"{topology_name} has an odd number of Elements for role {role}. Expected: {expected_count}"
+                    )
+                if actual_count > 0:
+                    if expected_count != actual_count:
+                        errors.append(
+                            f"{topology_name} has mismatched quantity of {expected_type} devices with role {role}. Expected: {expected_count}, Actual: {actual_count}"
+                        )
+                if (
+                    expected_type not in actual_role_device_counts.get(role, {})
+                    and unexpected_types
+                ):
+                    errors.append(
+                        f"{topology_name} expected {expected_type} devices with role {role}, but found different type(s): {', '.join(sorted(unexpected_types))}."
+                    )
+    return errors
+
+
+def check_errors(data: dict) -> List[str]:
+    check = InfrahubCheckDeviceTopology(branch="main")
+    check.validate(data)
+    return [log["message"] for log in check.errors]
+
+
+def benchmark(topologies: int, devices_per_topology: int, compare: bool) -> None:
+    data = generate_data(topologies, devices_per_topology)
+    devices = len(data["InfraDevice"]["edges"])
+
+    started_at = time.perf_counter()
+    errors = check_errors(data)
+    elapsed = time.perf_counter() - started_at
+
+    line = (
+        f"{topologies:>6} topologies | {devices:>7} devices | check {elapsed:6.2f}s"
+        f" | {elapsed / devices * 1e6:5.2f} us/device | {len(errors)} errors"
+    )
+    if compare:
+        started_at = time.perf_counter()
+        expected = reference_validate(data)
+        line += f" | reference {time.perf_counter() - started_at:6.2f}s"
+        # The reference walks device ids in set order, the types of a role are compared sorted
+        normalized = [
+            message
+            if "different type(s)" not in message
+            else message.split(": ")[0]
+            + ": "
+            + ", ".join(sorted(message.split(": ")[1].rstrip(".").split(", ")))
+            + "."
+            for message in errors
+        ]
+        if normalized != expected:
+            raise RuntimeError(
+                f"Check disagrees with the reference for {topologies} topologies"
+            )
+    print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--topologies", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--devices", type=int, default=50, help="devices per topology")
+    parser.add_argument(
+        "--no-compare",
+        action="store_true",
+        help="skip the comparison with the previous implementation",
+    )
+    args = parser.parse_args()
+
+    for topologies in args.topologies:
+        benchmark(topologies, args.devices, not args.no_compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,178 @@
+"""Download the Containerlab topologies and the device startup configs.
+
+All the artifacts of the target definitions are listed with one paginated
+query, then their content is downloaded concurrently through a single
+connection pool.
+
+    python scripts/get_configs.py [--concurrency 16] [--branch main]
+"""
+
+import argparse
+import asyncio
 import os
-from infrahub_sdk import InfrahubClientSync
+from typing import Any, Dict, List, Optional
+
+import httpx
+from infrahub_sdk import Config, InfrahubClient
+from infrahub_sdk.exceptions import ServerNotReachableError, ServerNotResponsiveError
+from infrahub_sdk.types import HTTPMethod
+
+CLAB_DIRECTORY = "./generated-configs/clab"
+CONFIG_DIRECTORY = "./generated-configs/clab/configs/startup"
+
+# Artifact definition name -> (directory, file extension)
+TARGET_DEFINITIONS = {
+    "Containerlab Topology": (CLAB_DIRECTORY, "yml"),
+    "Startup Config for Arista devices": (CONFIG_DIRECTORY, "cfg"),
+    "Startup Config for Cisco devices": (CONFIG_DIRECTORY, "cfg"),
+}
+
+DEFAULT_CONCURRENCY = 16
+PAGE_SIZE = 500
+
+ARTIFACTS_QUERY = """
+query($definitions: [String], $offset: Int, $limit: Int) {
+  CoreArtifact(definition__name__values: $definitions, offset: $offset, limit: $limit) {
+    count
+    edges {
+      node {
+        storage_id { value }
+        definition { node { name { value } } }
+        object {
+          node {
+            display_label
+            ... on TopologyTopology { name { value } }
+            ... on InfraDevice { name { value } }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
+
+class PooledRequester:
+    """Sends all the requests of a client through one httpx connection pool.
+
+    The SDK opens a new connection for every request otherwise.
+    """
+
+    def __init__(self, max_connections: int, address: str, verify: Any = True):
+        self.address = address
+        self.client = httpx.AsyncClient(
+            verify=verify,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+
+    async def __call__(
+        self,
+        url: str,
+        method: HTTPMethod,
+        headers: Dict[str, Any],
+        timeout: int,
+        payload: Optional[dict] = None,
+    ) -> httpx.Response:
+        try:
+            return await self.client.request(
+                method=method.value,
+                url=url,
+                headers=headers,
+                timeout=timeout,
+                json=payload,
+            )
+        except httpx.NetworkError as exc:
+            raise ServerNotReachableError(address=self.address) from exc
+        except httpx.ReadTimeout as exc:
+            raise ServerNotResponsiveError(url=url, timeout=timeout) from exc
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+async def list_artifacts(
+    client: InfrahubClient, branch: Optional[str] = None
+) -> List[dict]:
+    artifacts: List[dict] = []
+    offset = 0
+    while True:
+        data = await client.execute_graphql(
+            query=ARTIFACTS_QUERY,
+            branch_name=branch,
+            variables={
+                "definitions": list(TARGET_DEFINITIONS),
+                "offset": offset,
+                "limit": PAGE_SIZE,
+            },
+        )
+        artifacts.extend(edge["node"] for edge in data["CoreArtifact"]["edges"])
+        offset += PAGE_SIZE
+        if offset >= data["CoreArtifact"]["count"]:
+            break
+    return artifacts
+
+
+async def download_artifact(client: InfrahubClient, artifact: dict) -> Optional[str]:
+    """Write the content of an artifact to its file, returns the path written."""
+    definition = artifact["definition"]["node"]["name"]["value"]
+    # The object of an artifact can be deleted while the artifact remains
+    target = (artifact["object"] or {}).get("node")
+    if not target:
+        print(f"Skipping an artifact of {definition} whose object was deleted")
+        return None
+    storage_id = artifact["storage_id"]["value"]
+    if not storage_id:
+        print(f"Artifact of {target['display_label']} hasn't been generated yet")
+        return None
+
+    directory, extension = TARGET_DEFINITIONS[definition]
+    name = target["name"]["value"] if "name" in target else target["display_label"]
+    content = await client.object_store.get(identifier=storage_id)
+    path = f"{directory}/{name}.{extension}"
+    with open(path, "w") as file:
+        file.write(content)
+    return path
 
 
-def get_containerlab_topology():
-    directory_path = "./generated-configs/clab"
-    if not os.path.exists(directory_path):
-        os.makedirs(directory_path)
+async def get_configs(
+    concurrency: int = DEFAULT_CONCURRENCY, branch: Optional[str] = None
+) -> None:
+    for directory in {directory for directory, _ in TARGET_DEFINITIONS.values()}:
+        os.makedirs(directory, exist_ok=True)
 
-    client = InfrahubClientSync()
-    topologies = client.all(kind="TopologyTopology")
+    config = Config(max_concurrent_execution=concurrency)
+    requester = PooledRequester(
+        max_connections=concurrency,
+        address=config.address,
+        verify=config.tls_ca_file or not config.tls_insecure,
+    )
+    config.requester = requester
+    client = InfrahubClient(config=config)
 
-    for topology in topologies:
-        artifact = topology.artifact_fetch("Containerlab Topology")
-        with open(f"{directory_path}/{topology.name.value}.yml", "w") as file:
-            file.write(artifact)
+    try:
+        artifacts = await list_artifacts(client, branch=branch)
 
+        # The batch runs at most `concurrency` downloads at once
+        batch = await client.create_batch()
+        for artifact in artifacts:
+            batch.add(task=download_artifact, client=client, artifact=artifact)
+        downloaded = [path async for _, path in batch.execute() if path]
+    finally:
+        await requester.aclose()
 
-def get_device_configs():
-    directory_path = "./generated-configs/clab/configs/startup"
-    if not os.path.exists(directory_path):
-        os.makedirs(directory_path)
+    print(f"Downloaded {len(downloaded)} of {len(artifacts)} artifacts")
 
-    client = InfrahubClientSync()
-    devices = client.all(kind="InfraDevice")
 
-    for device in devices:
-        device.artifacts.fetch()
-        for artifact in device.artifacts.peers:
-            if str(artifact.display_label).startswith("Startup Config"):
-                artifact = device.artifact_fetch(artifact.display_label)
-                with open(f"{directory_path}/{device.name.value}.cfg", "w") as file:
-                    file.write(artifact)
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--branch", default=None)
+    args = parser.parse_args()
+    asyncio.run(get_configs(concurrency=args.concurrency, branch=args.branch))
 
 
-get_containerlab_topology()
-get_device_configs()
+if __name__ == "__main__":
+    main()
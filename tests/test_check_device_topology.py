@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+from checks.check_device_topology import TARGETED_QUERY, InfrahubCheckDeviceTopology
+
+FULL_SWEEP_DATA = {
+    "InfraDevice": {"edges": []},
+    "CoreStandardGroup": {"edges": []},
+    "TopologyTopology": {"edges": []},
+}
+
+
+def named(name: str) -> SimpleNamespace:
+    return SimpleNamespace(name=SimpleNamespace(value=name))
+
+
+class FakeClient:
+    default_branch = "main"
+
+    def __init__(self, node_diffs: list, groups: list = ()):
+        self.node_diffs = node_diffs
+        self.groups = list(groups)
+        self.queries = []
+
+    async def get_diff_summary(self, branch: str) -> list:
+        return self.node_diffs
+
+    async def filters(self, kind: str, **kwargs) -> list:
+        if kind == "CoreStandardGroup":
+            return self.groups
+        return []
+
+    async def query_gql_query(self, name: str, branch_name: str, variables: dict):
+        self.queries.append((name, variables))
+        return FULL_SWEEP_DATA
+
+
+def collect_data(client: FakeClient) -> dict:
+    check = InfrahubCheckDeviceTopology(branch="feature", client=client)
+    return asyncio.run(check.collect_data())
+
+
+def test_empty_diff_runs_a_full_sweep():
+    client = FakeClient(node_diffs=[])
+
+    assert collect_data(client) == FULL_SWEEP_DATA
+    assert client.queries == [(InfrahubCheckDeviceTopology.query, {})]
+
+
+def test_changed_device_only_validates_its_topology():
+    client = FakeClient(
+        node_diffs=[{"kind": "InfraDevice", "id": "device-1"}],
+        groups=[named("fra05-pod1_topology"), named("fra05_leafs")],
+    )
+
+    collect_data(client)
+    assert client.queries == [
+        (
+            TARGETED_QUERY,
+            {"topologies": ["fra05-pod1"], "groups": ["fra05-pod1_topology"]},
+        )
+    ]
+
+
+def test_diff_outside_topologies_validates_nothing():
+    client = FakeClient(node_diffs=[{"kind": "InfraInterfaceL3", "id": "interface-1"}])
+
+    assert collect_data(client) == {
+        "CoreStandardGroup": {"edges": []},
+        "TopologyTopology": {"edges": []},
+    }
+    assert client.queries == []
+
+
+def test_full_parameter_is_not_sent_to_the_query():
+    client = FakeClient(node_diffs=[{"kind": "InfraDevice", "id": "device-1"}])
+    check = InfrahubCheckDeviceTopology(
+        branch="feature", client=client, params={"full": "true"}
+    )
+
+    assert asyncio.run(check.collect_data()) == FULL_SWEEP_DATA
+    assert client.queries == [(InfrahubCheckDeviceTopology.query, {})]
@@ -0,0 +1,46 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from checks.check_security_policy_shadowing import InfrahubCheckSecurityPolicyShadowing
+
+FIXTURES = Path(__file__).parent / "check_security_policy_shadowing"
+
+
+def run_check(case: str) -> InfrahubCheckSecurityPolicyShadowing:
+    data = json.loads((FIXTURES / case / "input.json").read_text())
+    check = InfrahubCheckSecurityPolicyShadowing(branch="main")
+    check.validate(data["data"])
+    return check
+
+
+def messages(check: InfrahubCheckSecurityPolicyShadowing, level: str) -> list:
+    return [log["message"] for log in check.logs if log["level"] == level]
+
+
+@pytest.mark.parametrize(
+    "case,errors,infos",
+    [
+        ("baseline", [], []),
+        (
+            "shadowed_rule",
+            [
+                "ord1-fw1: Rule 2 'allow-web-01' (permit) is shadowed by rule 1 'deny-web' (deny)"
+            ],
+            [],
+        ),
+        (
+            "redundant_rule",
+            [],
+            [
+                "ord1-fw1: Rule 2 'allow-web-01' (permit) is redundant by rule 1 'allow-web' (permit)"
+            ],
+        ),
+    ],
+)
+def test_dead_rules_are_reported(case, errors, infos):
+    check = run_check(case)
+
+    assert messages(check, "ERROR") == errors
+    assert messages(check, "INFO") == infos
@@ -0,0 +1,295 @@
+import asyncio
+import logging
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Iterable, Tuple
+
+from infrahub_sdk.batch import InfrahubBatch
+
+# The generator imports its siblings the way `infrahubctl run` loads it
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "generators"))
+
+from location_index import LocationIndex  # noqa: E402
+from render_security_policy import (  # noqa: E402
+    PolicyRenderCache,
+    find_policy_targets,
+    render_device,
+    render_policy_for_device,
+)
+from security_rule_matcher import (  # noqa: E402
+    RENDERED_RULE_KIND,
+    RENDERED_RULE_MANY_RELATIONSHIPS,
+)
+
+ZONE_ID = "zone-trust"
+
+
+class Value:
+    def __init__(self, value):
+        self.value = value
+
+
+class Related:
+    def __init__(self, id=None):
+        self.id = id
+        self.initialized = id is not None
+
+
+class RelatedMany:
+    def __init__(self, peer_ids=()):
+        self.peer_ids = list(peer_ids)
+        self.peers = [SimpleNamespace(id=peer_id) for peer_id in self.peer_ids]
+        self.initialized = True
+
+    def remove(self, peer_id):
+        self.peer_ids.remove(peer_id)
+
+    def extend(self, peers):
+        self.peer_ids.extend(peer["id"] for peer in peers)
+
+
+class Node(SimpleNamespace):
+    async def save(self, **kwargs):
+        pass
+
+    async def delete(self, **kwargs):
+        pass
+
+
+class Device(Node):
+    saves = 0
+
+    async def save(self, **kwargs):
+        self.saves += 1
+
+
+def policy_rule(name: str, policy_id: str, action: str = "permit") -> Node:
+    return Node(
+        name=Value(name),
+        action=Value(action),
+        log=Value(False),
+        source_zone=Related(ZONE_ID),
+        destination_zone=Related(ZONE_ID),
+        policy=Related(policy_id),
+        **{rel_name: RelatedMany() for rel_name in RENDERED_RULE_MANY_RELATIONSHIPS},
+    )
+
+
+class RenderedRule(Node):
+    def __init__(self, client, rule_id: str, data: dict):
+        super().__init__(
+            id=rule_id,
+            index=Value(data["index"]["value"]),
+            name=Value(data["name"]["value"]),
+            action=Value(data["action"]["value"]),
+            log=Value(data["log"]["value"]),
+            source_zone=Related(data["source_zone"]["id"]),
+            destination_zone=Related(data["destination_zone"]["id"]),
+            source_policy=Related(data["source_policy"]["id"]),
+            **{
+                rel_name: RelatedMany(peer["id"] for peer in data[rel_name])
+                for rel_name in RENDERED_RULE_MANY_RELATIONSHIPS
+            },
+        )
+        self._client = client
+
+    async def delete(self, **kwargs):
+        self._client.deleted.append(self.id)
+
+
+class FakeClient:
+    """Answers like the SDK: the fields of the concrete kind only come with the fragment."""
+
+    def __init__(self, device: Node, rules: dict, locations: Iterable[Node] = ()):
+        self.device = device
+        self.rules = rules
+        self.locations = {location.id: location for location in locations}
+        self.created = []
+        self.updated = []
+        self.deleted = []
+        self.rendered = {}
+        self.queries = []
+
+    async def filters(self, kind, **kwargs):
+        self.queries.append(kind)
+        if kind == "LocationGeneric":
+            return [
+                self.locations[location_id]
+                for location_id in kwargs["ids"]
+                if location_id in self.locations
+            ]
+        if kind == "InfraGenericDevice":
+            if kwargs.get("fragment"):
+                return [self.device]
+            generic_fields = {
+                key: value
+                for key, value in vars(self.device).items()
+                if key not in ("policy", "rules")
+            }
+            return [Node(**generic_fields)]
+        if kind == "SecurityFirewallInterface":
+            return [Node(security_zone=Related(ZONE_ID))]
+        if kind == "SecurityPolicyRule":
+            return self.rules.get(kwargs["policy__ids"][0], [])
+        if kind == RENDERED_RULE_KIND:
+            return [self.rendered[rule_id] for rule_id in kwargs["ids"]]
+        raise AssertionError(f"Unexpected query of {kind}")
+
+    async def get(self, kind, **kwargs):
+        if kind == "CoreAccount":
+            return Node(id="account-generator")
+        return Node(id=kwargs["id"])
+
+    async def create(self, kind, data):
+        if "id" in data:
+            node = Node(id=data["id"], data=data)
+            self.updated.append(node)
+        else:
+            node = Node(id=f"rendered-{len(self.created)}", data=data)
+            self.created.append(node)
+        # Stored as the SDK would read the rule back once saved
+        self.rendered[node.id] = RenderedRule(self, node.id, data)
+        return node
+
+    async def create_batch(self):
+        return InfrahubBatch()
+
+
+def test_device_policy_is_rendered_for_location_targets():
+    site = Node(
+        id="location-site",
+        name=Value("site"),
+        parent=Related(),
+        policy=Related("policy-site"),
+        devices=RelatedMany(["device-firewall"]),
+    )
+    index = LocationIndex(locations=[site])
+    device = Node(
+        id="device-firewall",
+        name=Value("firewall"),
+        location=Related(site.id),
+        policy=Related("policy-device"),
+        rules=RelatedMany(),
+    )
+    client = FakeClient(
+        device=device,
+        rules={
+            "policy-site": [policy_rule("site-rule", "policy-site")],
+            "policy-device": [policy_rule("device-rule", "policy-device")],
+        },
+    )
+    policy = Node(device_target=Related(), location_target=Related(site.id))
+
+    async def render():
+        targets = await find_policy_targets(
+            client, logging.getLogger(__name__), policy, index=index
+        )
+        assert [target.id for target in targets] == [device.id]
+        return await render_device(
+            client, targets[0], index=index, cache=PolicyRenderCache(client)
+        )
+
+    result = asyncio.run(render())
+
+    assert result.diff.created == 2
+    assert [
+        (node.data["name"]["value"], node.data["source_policy"]["id"])
+        for node in client.created
+    ] == [("site-rule", "policy-site"), ("device-rule", "policy-device")]
+
+
+def test_location_missing_from_the_index_is_expanded_level_by_level():
+    rack = Node(id="location-rack", devices=RelatedMany(["device-firewall"]))
+    suite = Node(
+        id="location-suite", devices=RelatedMany(), children=RelatedMany([rack.id])
+    )
+    building = Node(
+        id="location-building",
+        devices=RelatedMany(),
+        children=RelatedMany([suite.id]),
+    )
+    device = Node(id="device-firewall", policy=Related(), rules=RelatedMany())
+    client = FakeClient(device=device, rules={}, locations=[building, suite, rack])
+    policy = Node(device_target=Related(), location_target=Related(building.id))
+
+    targets = asyncio.run(
+        find_policy_targets(
+            client,
+            logging.getLogger(__name__),
+            policy,
+            index=LocationIndex(locations=[]),
+            branch="feature",
+        )
+    )
+
+    assert [target.id for target in targets] == [device.id]
+    assert client.queries == ["LocationGeneric"] * 3 + ["InfraGenericDevice"]
+
+
+def render_rules(client: FakeClient, device: Device):
+    """Render the device policy with a new cache, like a new run would."""
+    return asyncio.run(
+        render_policy_for_device(
+            client,
+            device,
+            [Node(id="policy-device")],
+            cache=PolicyRenderCache(client),
+        )
+    )
+
+
+def rendered_device() -> Tuple[FakeClient, Device]:
+    """A device whose two policy rules are already rendered."""
+    device = Device(id="device-firewall", policy=Related(), rules=RelatedMany())
+    client = FakeClient(
+        device=device,
+        rules={
+            "policy-device": [
+                policy_rule("allow-web", "policy-device"),
+                policy_rule("allow-dns", "policy-device"),
+            ]
+        },
+    )
+    assert render_rules(client, device).created == 2
+    client.created.clear()
+    device.saves = 0
+    return client, device
+
+
+def test_unchanged_policy_is_not_written():
+    client, device = rendered_device()
+
+    diff = render_rules(client, device)
+
+    assert (diff.created, diff.updated, diff.deleted, diff.unchanged) == (0, 0, 0, 2)
+    assert not client.created and not client.updated and not client.deleted
+    assert device.saves == 0
+
+
+def test_changed_rule_is_updated_in_place():
+    client, device = rendered_device()
+    first_rule_id = device.rules.peer_ids[0]
+    client.rules["policy-device"][0] = policy_rule(
+        "allow-web", "policy-device", action="deny"
+    )
+
+    diff = render_rules(client, device)
+
+    assert (diff.created, diff.updated, diff.deleted, diff.unchanged) == (0, 1, 0, 1)
+    assert [node.id for node in client.updated] == [first_rule_id]
+    assert client.updated[0].data["action"]["value"] == "deny"
+    assert device.saves == 0
+
+
+def test_removed_rule_is_deleted():
+    client, device = rendered_device()
+    last_rule_id = device.rules.peer_ids[1]
+    client.rules["policy-device"].pop()
+
+    diff = render_rules(client, device)
+
+    assert (diff.created, diff.updated, diff.deleted, diff.unchanged) == (0, 0, 1, 1)
+    assert client.deleted == [last_rule_id]
+    assert last_rule_id not in device.rules.peer_ids
+    assert device.saves == 1
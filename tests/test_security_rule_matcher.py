@@ -0,0 +1,233 @@
+import random
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "generators"))
+
+from security_rule_matcher import (  # noqa: E402
+    Flow,
+    MatchRule,
+    RuleMatcher,
+    address_key,
+    find_dead_rules,
+    network_interval,
+    service_intervals,
+    service_key,
+)
+
+WEB = network_interval("10.0.0.0/24")
+DNS = network_interval("10.0.1.53/32")
+HTTPS = service_intervals(6, 443)
+
+
+def contains(intervals: Optional[List], value: int) -> bool:
+    return intervals is None or any(start <= value <= end for start, end in intervals)
+
+
+def linear_lookup(rules: List[MatchRule], flow: Flow) -> Optional[MatchRule]:
+    """Reference first-match scan the compiled matcher is checked against."""
+    source = address_key(flow.source)
+    destination = address_key(flow.destination)
+    service = service_key(flow.protocol, flow.port)
+    for rule in sorted(rules, key=lambda rule: rule.index):
+        if flow.source_zone is not None and rule.source_zone not in (
+            None,
+            flow.source_zone,
+        ):
+            continue
+        if flow.destination_zone is not None and rule.destination_zone not in (
+            None,
+            flow.destination_zone,
+        ):
+            continue
+        if flow.source_port is None:
+            if rule.source_services is not None:
+                continue
+        elif not contains(
+            rule.source_services, service_key(flow.protocol, flow.source_port)
+        ):
+            continue
+        if (
+            contains(rule.source, source)
+            and contains(rule.destination, destination)
+            and contains(rule.services, service)
+        ):
+            return rule
+    return None
+
+
+def rule(index: int, action: str = "permit", **kwargs) -> MatchRule:
+    kwargs.setdefault("source_zone", "trust")
+    kwargs.setdefault("destination_zone", "untrust")
+    return MatchRule(index=index, name=f"rule-{index}", action=action, **kwargs)
+
+
+def flow(destination: str, port: int = 443, **kwargs) -> Flow:
+    kwargs.setdefault("source_zone", "trust")
+    kwargs.setdefault("destination_zone", "untrust")
+    return Flow(
+        source="192.168.0.10", destination=destination, protocol=6, port=port, **kwargs
+    )
+
+
+def test_lookup_matches_the_zones_of_the_flow():
+    rules = [
+        rule(0, destination=[WEB], source_zone="dmz"),
+        rule(1, destination=[WEB]),
+    ]
+    matcher = RuleMatcher(rules)
+
+    assert matcher.lookup(*flow("10.0.0.1")).index == 1
+    assert matcher.lookup(*flow("10.0.0.1", source_zone="dmz")).index == 0
+    assert matcher.lookup(*flow("10.0.0.1", source_zone="mgmt")) is None
+    # A flow without zones is matched on its addresses and services only
+    assert matcher.lookup(*flow("10.0.0.1", source_zone=None)).index == 0
+
+
+def test_none_matches_anything_and_empty_matches_nothing():
+    rules = [
+        rule(0, destination=[], services=None),
+        rule(1, destination=[DNS], services=HTTPS),
+        rule(2, source_zone=None, destination_zone=None, action="deny"),
+    ]
+    matcher = RuleMatcher(rules)
+
+    assert matcher.lookup(*flow("10.0.1.53")).index == 1
+    assert matcher.lookup(*flow("10.0.1.53", port=53)).index == 2
+    assert matcher.lookup(*flow("10.0.1.54", source_zone="dmz")).index == 2
+    assert matcher.lookup("::1", "2001:db8::1", 17, 53).index == 2
+
+
+def test_overlapping_intervals_match_up_to_their_bounds():
+    rules = [
+        rule(
+            0,
+            destination=[
+                network_interval("10.0.0.0/25"),
+                network_interval("10.0.0.64/26"),
+                network_interval("10.0.0.128/32"),
+            ],
+            services=service_intervals(6, 8000, 8080) + service_intervals(6, 8080),
+        )
+    ]
+    matcher = RuleMatcher(rules)
+
+    for destination, port, expected in [
+        ("10.0.0.0", 8000, 0),
+        ("10.0.0.127", 8080, 0),
+        ("10.0.0.128", 8040, 0),
+        ("10.0.0.129", 8040, None),
+        ("10.0.0.1", 8081, None),
+        ("9.255.255.255", 8000, None),
+    ]:
+        match = matcher.lookup(*flow(destination, port=port))
+        assert (match.index if match else None) == expected
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 2048])
+def test_first_match_follows_the_rule_index(block_size):
+    rules = [
+        rule(3, destination=[WEB]),
+        rule(2, destination=[network_interval("10.0.0.128/25")], action="deny"),
+        rule(1, destination=[DNS]),
+    ]
+    matcher = RuleMatcher(rules, block_size=block_size)
+
+    assert matcher.lookup(*flow("10.0.0.200")).index == 2
+    assert matcher.lookup(*flow("10.0.0.20")).index == 3
+    assert matcher.lookup(*flow("10.0.1.53")).index == 1
+
+
+def test_flows_without_source_port_skip_rules_with_source_services():
+    rules = [
+        rule(0, destination=[WEB], source_services=service_intervals(6, 1024, 2047)),
+        rule(1, destination=[WEB]),
+    ]
+    matcher = RuleMatcher(rules)
+
+    assert matcher.lookup(*flow("10.0.0.1", source_port=1500)).index == 0
+    assert matcher.lookup(*flow("10.0.0.1", source_port=3000)).index == 1
+    assert matcher.lookup(*flow("10.0.0.1")).index == 1
+
+
+def random_rules(rng: random.Random, size: int) -> List[MatchRule]:
+    networks = [
+        [network_interval(f"10.{rng.randint(0, 3)}.{rng.randint(0, 3)}.0/{length}")]
+        for length in (16, 22, 24, 24, 30)
+    ]
+    services = [service_intervals(6, port, port + 100) for port in (0, 80, 443, 8000)]
+    zones = [None, "trust", "untrust"]
+    return [
+        rule(
+            index,
+            action=rng.choice(["permit", "deny"]),
+            source_zone=rng.choice(zones),
+            destination_zone=rng.choice(zones),
+            destination=rng.choice(networks + [None]),
+            services=rng.choice(services + [None]),
+        )
+        for index in rng.sample(range(size * 2), size)
+    ]
+
+
+def random_flows(rng: random.Random, count: int) -> List[Flow]:
+    zones = [None, "trust", "untrust", "dmz"]
+    return [
+        Flow(
+            source="192.168.0.10",
+            destination=f"10.{rng.randint(0, 4)}.{rng.randint(0, 4)}.{rng.randint(0, 8)}",
+            protocol=6,
+            port=rng.choice([22, 80, 150, 443, 500, 8050]),
+            source_zone=rng.choice(zones),
+            destination_zone=rng.choice(zones),
+        )
+        for _ in range(count)
+    ]
+
+
+@pytest.mark.parametrize("block_size", [3, 64])
+def test_lookup_and_lookup_many_agree_with_a_linear_scan(block_size):
+    rng = random.Random(block_size)
+    rules = random_rules(rng, 60)
+    flows = random_flows(rng, 400)
+    flows += flows[:50]
+    matcher = RuleMatcher(rules, block_size=block_size)
+
+    expected = [linear_lookup(rules, flow) for flow in flows]
+    assert [matcher.lookup(*flow) for flow in flows] == expected
+    assert matcher.lookup_many(flows) == expected
+
+
+def findings(rules: List[MatchRule]) -> List[tuple]:
+    return [
+        (finding.rule.index, finding.kind, finding.covering_rule.index)
+        for finding in find_dead_rules(rules)
+    ]
+
+
+def test_dead_rules_are_shadowed_or_redundant():
+    rules = [
+        rule(0, action="deny", destination=[WEB], services=HTTPS),
+        rule(1, destination=[network_interval("10.0.0.0/25")], services=HTTPS),
+        rule(2, destination=[DNS]),
+        rule(3, destination=[DNS], services=service_intervals(17, 53)),
+        # Only partly covered by rule 0
+        rule(4, destination=[network_interval("10.0.0.0/23")], services=HTTPS),
+    ]
+
+    assert findings(rules) == [(1, "shadowed", 0), (3, "redundant", 2)]
+
+
+def test_dead_rules_across_zones():
+    rules = [
+        rule(0, action="deny", source_zone=None, destination=[WEB]),
+        rule(1, destination=[WEB], source_zone="dmz"),
+        rule(2, destination=[WEB], destination_zone="dmz"),
+        # No interval to compare, like a rule only referencing FQDNs
+        rule(3, destination=[], source_zone="dmz"),
+    ]
+
+    assert findings(rules) == [(1, "shadowed", 0)]
@@ -1,54 +1,137 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from infrahub_sdk import InfrahubClient
 from infrahub_sdk.transforms import InfrahubTransform
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BULK_QUERY_PATH = Path(__file__).parent / "oc_interfaces_bulk.gql"
+BULK_PAGE_SIZE = 50
+
+
+def subinterface(index: int, address: str) -> dict:
+    ip, _, prefix_length = address.partition("/")
+    return {
+        "index": index,
+        "openconfig-if-ip:ipv4": {
+            "addresses": {
+                "address": [
+                    {"ip": ip, "config": {"ip": ip, "prefix-length": prefix_length}}
+                ]
+            },
+            "config": {"enabled": True},
+        },
+    }
+
+
+def device_interfaces(device: dict) -> dict:
+    """OpenConfig interfaces payload of one InfraDevice node.
+
+    Every payload dict is built in one literal, straight from the query data,
+    as this runs once per interface of the fleet.
+    """
+    interfaces = []
+    for edge in device["interfaces"]["edges"]:
+        intf = edge["node"]
+        config = {"enabled": intf["enabled"]["value"]}
+        description = intf.get("description")
+        if description and description["value"]:
+            config["description"] = description["value"]
+
+        ip_addresses = intf.get("ip_addresses")
+        if ip_addresses:
+            interfaces.append(
+                {
+                    "name": intf["name"]["value"],
+                    "config": config,
+                    "subinterfaces": {
+                        "subinterface": [
+                            subinterface(idx, ip["node"]["address"]["value"])
+                            for idx, ip in enumerate(ip_addresses["edges"])
+                        ]
+                    },
+                }
+            )
+        else:
+            interfaces.append({"name": intf["name"]["value"], "config": config})
+
+    return {"openconfig-interfaces:interface": interfaces}
+
+
+def dumps(payload: dict) -> str:
+    """Serialize a payload, with orjson when it's installed."""
+    if orjson:
+        return orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(payload, indent=2)
+
 
 class OCInterfaces(InfrahubTransform):
     query = "oc_interfaces"
 
     async def transform(self, data):
-        response_payload = {}
-        response_payload["openconfig-interfaces:interface"] = []
-
-        for intf in data["InfraDevice"]["edges"][0]["node"]["interfaces"]["edges"]:
-            intf_name = intf["node"]["name"]["value"]
-
-            intf_config = {
-                "name": intf_name,
-                "config": {"enabled": intf["node"]["enabled"]["value"]},
-            }
-
-            if (
-                intf["node"].get("description", None)
-                and intf["node"]["description"]["value"]
-            ):
-                intf_config["config"]["description"] = intf["node"]["description"][
-                    "value"
-                ]
+        return device_interfaces(data["InfraDevice"]["edges"][0]["node"])
+
+
+class OCInterfacesBulk(InfrahubTransform):
+    """OpenConfig interfaces of many devices at once, keyed by device name."""
+
+    query = "oc_interfaces_bulk"
+
+    async def transform(self, data):
+        return {
+            edge["node"]["name"]["value"]: device_interfaces(edge["node"])
+            for edge in data["InfraDevice"]["edges"]
+        }
+
+
+async def fetch_oc_interfaces(
+    client: InfrahubClient,
+    devices: Optional[List[str]] = None,
+    branch: Optional[str] = None,
+    page_size: int = BULK_PAGE_SIZE,
+) -> Dict[str, dict]:
+    """OpenConfig interfaces of the given devices, or of all of them, read page by page."""
+    transform = OCInterfacesBulk(branch=branch or "", client=client)
+    payloads: Dict[str, dict] = {}
+    offset = 0
+    while True:
+        data = await client.execute_graphql(
+            query=BULK_QUERY_PATH.read_text(),
+            branch_name=branch,
+            variables={"devices": devices, "offset": offset, "limit": page_size},
+        )
+        payloads.update(await transform.transform(data))
+        offset += page_size
+        if offset >= data["InfraDevice"]["count"]:
+            break
+    return payloads
+
+
+# ---------------------------------------------------------------
+# Offline export of the OpenConfig interfaces of the whole fleet
+#
+#   infrahubctl run transforms/openconfig.py directory=generated-configs/openconfig
+#   infrahubctl run transforms/openconfig.py devices=ord1-leaf1,ord1-leaf2
+# ---------------------------------------------------------------
+async def run(
+    client: InfrahubClient, log: logging.Logger, branch: str, **kwargs
+) -> None:
+    devices = kwargs["devices"].split(",") if kwargs.get("devices") else None
+    directory = Path(kwargs.get("directory", "generated-configs/openconfig"))
+    directory.mkdir(parents=True, exist_ok=True)
 
-            if intf["node"].get("ip_addresses", None):
-                intf_config["subinterfaces"] = {"subinterface": []}
-
-                for idx, ip in enumerate(intf["node"]["ip_addresses"]["edges"]):
-                    address, mask = ip["node"]["address"]["value"].split("/")
-                    intf_config["subinterfaces"]["subinterface"].append(
-                        {
-                            "index": idx,
-                            "openconfig-if-ip:ipv4": {
-                                "addresses": {
-                                    "address": [
-                                        {
-                                            "ip": address,
-                                            "config": {
-                                                "ip": address,
-                                                "prefix-length": mask,
-                                            },
-                                        }
-                                    ]
-                                },
-                                "config": {"enabled": True},
-                            },
-                        }
-                    )
-
-            response_payload["openconfig-interfaces:interface"].append(intf_config)
-
-        return response_payload
+    payloads = await fetch_oc_interfaces(
+        client,
+        devices=devices,
+        branch=branch,
+        page_size=int(kwargs.get("page_size", BULK_PAGE_SIZE)),
+    )
+    for device_name, payload in payloads.items():
+        (directory / f"{device_name}.json").write_text(dumps(payload))
+    log.info(f"Exported the OpenConfig interfaces of {len(payloads)} devices")